@@ -0,0 +1,52 @@
+import pytest
+import sqlalchemy as sa
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from umeta import cli, config, models
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """
+    session on an empty in-memory sqlite database, without a search backend
+    """
+    monkeypatch.setattr(config.config, 'search_backend', None)
+    engine = sa.create_engine('sqlite://', poolclass=StaticPool)
+    models.Base.metadata.create_all(bind=engine)
+    db = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    yield db
+    db.close()
+    engine.dispose()
+
+
+@pytest.fixture
+def root(tmp_path):
+    """
+    disk source root, with one empty bucket b
+    """
+    root = tmp_path / 'root'
+    (root / 'b').mkdir(parents=True)
+    return root
+
+
+@pytest.fixture
+def index(db, root):
+    """
+    reindex root as the disk source `test`, like `umeta index`
+    """
+    c = config.Config(
+        sources=[
+            config.Source(
+                type='disk',
+                name='test',
+                generators=[],
+                properties=config.Disk(root=str(root)),
+            )
+        ]
+    )
+
+    def index(**options):
+        cli.index(c, db, 'test', **options)
+
+    return index
@@ -0,0 +1,110 @@
+import pytest
+
+from umeta import cli, config, crud, models
+from umeta.sources import disk
+
+
+def changes(db, since=0, page_size=1):
+    # the bucket is only modified when its mtime ticks over a second
+    return [
+        (change['reindex'], change['change'], change['path'])
+        for change in crud.get_changes(db, since, page_size)
+        if change['path'] != 'b'
+    ]
+
+
+def test_order(db, root, index):
+    (root / 'b' / 'f1').write_text('1')
+    (root / 'b' / 'f2').write_text('2')
+    (root / 'b' / 'f3').write_text('3')
+    index()
+    (root / 'b' / 'f1').unlink()
+    (root / 'b' / 'f2').write_text('22')
+    index()
+    (root / 'b' / 'f3').unlink()
+    (root / 'b' / 'f4').write_text('4')
+    index()
+    assert changes(db) == [
+        (2, 'deleted', 'b/f1'),
+        (2, 'added', 'b/f2'),
+        (3, 'deleted', 'b/f3'),
+        (3, 'added', 'b/f4'),
+    ]
+    assert changes(db, since=1) == [
+        (2, 'deleted', 'b/f1'),
+        (2, 'modified', 'b/f2'),
+        (3, 'deleted', 'b/f3'),
+        (3, 'added', 'b/f4'),
+    ]
+    assert changes(db, since=1, page_size=10) == changes(db, since=1)
+    assert changes(db, since=3) == []
+
+
+@pytest.fixture
+def index_two(db, tmp_path, monkeypatch):
+    """
+    index one of two disk sources, a with bucket a and z with bucket z,
+    optionally failing the scan
+    """
+    c = config.Config(sources=[])
+    for name in ('a', 'z'):
+        (tmp_path / name / name).mkdir(parents=True)
+        (tmp_path / name / name / 'f').write_text(name)
+        c.sources.append(
+            config.Source(
+                type='disk',
+                name=name,
+                generators=[],
+                properties=config.Disk(root=str(tmp_path / name)),
+            )
+        )
+    index_bucket = disk.index_bucket
+
+    def failing(source, bucket, after=None):
+        yield from index_bucket(source, bucket, after)
+        raise OSError('scan failed')
+
+    def index(name, fail=False, **options):
+        if fail:
+            monkeypatch.setattr(disk, 'index_bucket', failing)
+        try:
+            cli.index(c, db, name, **options)
+        finally:
+            monkeypatch.setattr(disk, 'index_bucket', index_bucket)
+
+    return index
+
+
+def test_stop_at_resumable(db, index_two):
+    index_two('a')
+    with pytest.raises(OSError):
+        index_two('a', fail=True)
+    index_two('z')
+    # reindex 2 may still be resumed, so reindex 3 is held back
+    assert changes(db, since=1) == []
+    index_two('a', resume=True)
+    assert changes(db, since=1) == [
+        (3, 'added', 'z'),
+        (3, 'added', 'z/f'),
+    ]
+
+
+def test_skip_superseded(db, index_two):
+    index_two('a')
+    with pytest.raises(OSError):
+        index_two('a', fail=True)
+    index_two('a')
+    index_two('z')
+    assert changes(db, since=1) == [
+        (4, 'added', 'z'),
+        (4, 'added', 'z/f'),
+    ]
+
+
+def test_stop_at_running(db, index_two):
+    index_two('a')
+    source = db.query(models.Source).filter(models.Source.name == 'a').one()
+    db.add(models.Reindex(source=source))
+    db.commit()
+    index_two('z')
+    assert changes(db, since=1) == []
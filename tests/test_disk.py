@@ -0,0 +1,80 @@
+import os
+
+import pytest
+
+from umeta import config, core
+from umeta.sources import disk
+
+
+@pytest.fixture
+def source(tmp_path):
+    for key in ('a/x', 'a/y/z', 'c/w', 'd', '.hidden/v'):
+        path = tmp_path / 'b' / key
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(key)
+    return config.Source(
+        type='disk',
+        name='test',
+        generators=[],
+        properties=config.Disk(root=str(tmp_path)),
+    )
+
+
+@pytest.fixture
+def listed(monkeypatch):
+    """
+    paths os.scandir was called on
+    """
+    calls = []
+    scandir = os.scandir
+
+    def spy(path):
+        calls.append(path)
+        return scandir(path)
+
+    monkeypatch.setattr(disk.os, 'scandir', spy)
+    return calls
+
+
+def keys(source, after=None):
+    return [obj.key for obj in disk.index_bucket(source, 'b', after)]
+
+
+def test_walk_order(source):
+    assert keys(source) == ['a', 'c', 'd', 'a/x', 'a/y', 'a/y/z', 'c/w']
+
+
+@pytest.mark.parametrize(
+    'after,expected',
+    [
+        ('', ['a/x', 'a/y', 'a/y/z', 'c/w']),
+        ('a', ['a/y/z', 'c/w']),
+        ('a/y', ['c/w']),
+        ('c', []),
+    ],
+)
+def test_after(source, after, expected):
+    assert keys(source, after) == expected
+
+
+def test_after_skips_subtrees(source, listed):
+    keys(source, 'c')
+    root = os.path.join(source.properties.root, 'b')
+    assert [os.path.relpath(path, root) for path in listed] == ['.', 'c']
+
+
+def test_unreadable(source, monkeypatch):
+    scandir = os.scandir
+
+    def failing(path):
+        if path.endswith(os.path.join('a', 'y')):
+            raise PermissionError(13, 'Permission denied', path)
+        return scandir(path)
+
+    monkeypatch.setattr(disk.os, 'scandir', failing)
+    objects = list(disk.index_bucket(source, 'b'))
+    unreadable = [obj for obj in objects if obj.unreadable]
+    assert [(obj.key, obj.type) for obj in unreadable] == [
+        ('a/y', core.ObjectType.directory)
+    ]
+    assert 'a/y/z' not in [obj.key for obj in objects]
@@ -0,0 +1,157 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import pytest
+
+from umeta import export
+
+STALL_SECONDS = 1
+
+
+class Stub(ThreadingMixIn, HTTPServer):
+    """
+    local _bulk endpoint.  each request is answered by the next scripted
+    response, or accepted in full once the script runs out.  a scripted
+    response is an http status, a list of item statuses, or 'stall' to
+    answer after STALL_SECONDS.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, script):
+        super().__init__(('127.0.0.1', 0), Handler)
+        self.script = list(script)
+        self.requests = []
+        self.lock = threading.Lock()
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        lines = iter(body.decode().splitlines())
+        actions = []
+        for line in lines:
+            action, meta = next(iter(json.loads(line).items()))
+            actions.append((action, meta['_id']))
+            if action == 'index':
+                next(lines)
+        ids = [i for _, i in actions]
+        with self.server.lock:
+            self.server.requests.append((self.path, ids, len(body)))
+            reply = self.server.script.pop(0) if self.server.script else 200
+        if reply == 'stall':
+            time.sleep(STALL_SECONDS)
+            reply = 200
+        if isinstance(reply, int) and reply != 200:
+            self.respond(reply, {'error': 'stub'})
+            return
+        statuses = reply if isinstance(reply, list) else [201] * len(ids)
+        items = [
+            {action: {'_id': i, 'status': s}}
+            for (action, i), s in zip(actions, statuses)
+        ]
+        self.respond(
+            200, {'errors': any(s >= 400 for s in statuses), 'items': items}
+        )
+
+    def respond(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        try:
+            self.wfile.write(data)
+        except ConnectionError:
+            # the client gave up waiting
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub(request):
+    server = Stub(getattr(request, 'param', []))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def documents(n):
+    return ((i, {'name': f'object {i}'}) for i in range(n))
+
+
+def run(stub, n, docs=None, **options):
+    url = f'http://127.0.0.1:{stub.server_port}'
+    options.setdefault('backoff', 0.01)
+    docs = documents(n) if docs is None else docs
+    return sum(export.export(docs, url, 'umeta', **options))
+
+
+@pytest.mark.parametrize('stub', [[503, 429]], indirect=True)
+def test_retry_statuses(stub):
+    assert run(stub, 3, concurrency=1) == 3
+    assert len(stub.requests) == 3
+    assert all(ids == ['0', '1', '2'] for _, ids, _ in stub.requests)
+    assert stub.requests[0][0] == '/_bulk'
+
+
+@pytest.mark.parametrize('stub', [[[201, 429, 201, 429]]], indirect=True)
+def test_retry_items(stub):
+    assert run(stub, 4, concurrency=1) == 4
+    assert [ids for _, ids, _ in stub.requests] == [
+        ['0', '1', '2', '3'],
+        ['1', '3'],
+    ]
+
+
+@pytest.mark.parametrize('stub', [[503] * 3], indirect=True)
+def test_give_up(stub):
+    with pytest.raises(export.ExportError):
+        run(stub, 1, max_retries=2)
+    assert len(stub.requests) == 3
+
+
+@pytest.mark.parametrize('stub', [[400]], indirect=True)
+def test_client_error(stub):
+    with pytest.raises(export.ExportError):
+        run(stub, 1)
+    assert len(stub.requests) == 1
+
+
+def test_batch_docs(stub):
+    assert run(stub, 10, max_docs=4) == 10
+    sent = sorted(ids for _, ids, _ in stub.requests)
+    assert sorted(len(ids) for ids in sent) == [2, 4, 4]
+    assert sorted(i for ids in sent for i in ids) == sorted(
+        str(i) for i in range(10)
+    )
+
+
+def test_batch_bytes(stub):
+    item = len(next(export.batches(documents(1), 'umeta', 1, 1 << 20))[0])
+    assert run(stub, 10, max_bytes=item * 3) == 10
+    assert all(size <= item * 3 for _, _, size in stub.requests)
+    assert sorted(len(ids) for _, ids, _ in stub.requests) == [1, 3, 3, 3]
+
+
+@pytest.mark.parametrize('stub', [['stall']], indirect=True)
+def test_timeout(stub):
+    assert run(stub, 2, concurrency=1, timeout=STALL_SECONDS / 5) == 2
+    assert len(stub.requests) == 2
+
+
+@pytest.mark.parametrize('stub', [[[200, 404, 201]]], indirect=True)
+def test_delete(stub):
+    docs = [(0, None), (1, None), (2, {'name': 'object 2'})]
+    body = next(export.batches(iter(docs), 'umeta', 10, 1 << 20))
+    assert [len(item.splitlines()) for item in body] == [1, 1, 2]
+    # deleting a document the target never had is not an error
+    assert run(stub, 3, docs=iter(docs), concurrency=1) == 3
+    assert len(stub.requests) == 1
@@ -0,0 +1,67 @@
+import shutil
+
+from umeta import core, crud
+
+
+def write(root, key, size):
+    path = root / 'b' / key
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b'x' * size)
+
+
+def rollup(db, key=None):
+    obj = crud.get_object(db, 'b', key)
+    db.refresh(obj)
+    return obj.type, obj.total_size, obj.file_count
+
+
+def test_add(db, root, index):
+    write(root, 'p', 10)
+    write(root, 'd/x', 5)
+    write(root, 'd/e/y', 3)
+    index()
+    assert rollup(db) == (core.ObjectType.directory, 18, 3)
+    assert rollup(db, 'd') == (core.ObjectType.directory, 8, 2)
+    assert rollup(db, 'd/e') == (core.ObjectType.directory, 3, 1)
+    assert rollup(db, 'p') == (core.ObjectType.file, 10, 1)
+
+
+def test_file_to_directory(db, root, index):
+    write(root, 'p', 10)
+    write(root, 'd/x', 5)
+    index()
+    (root / 'b' / 'p').unlink()
+    write(root, 'p/q', 4)
+    index()
+    assert rollup(db) == (core.ObjectType.directory, 9, 2)
+    assert rollup(db, 'p') == (core.ObjectType.directory, 4, 1)
+    assert rollup(db, 'p/q') == (core.ObjectType.file, 4, 1)
+
+
+def test_directory_to_file(db, root, index):
+    write(root, 'p', 10)
+    write(root, 'd/x', 5)
+    write(root, 'd/e/y', 3)
+    index()
+    shutil.rmtree(root / 'b' / 'd')
+    write(root, 'd', 7)
+    index()
+    assert rollup(db) == (core.ObjectType.directory, 17, 2)
+    assert rollup(db, 'd') == (core.ObjectType.file, 7, 1)
+    assert crud.get_object(db, 'b', 'd/e') is None
+
+
+def test_delete_subtree(db, root, index):
+    write(root, 'p', 10)
+    write(root, 'd/x', 5)
+    write(root, 'd/e/y', 3)
+    write(root, 'd/e/z', 2)
+    index()
+    shutil.rmtree(root / 'b' / 'd' / 'e')
+    index()
+    assert rollup(db) == (core.ObjectType.directory, 15, 2)
+    assert rollup(db, 'd') == (core.ObjectType.directory, 5, 1)
+    shutil.rmtree(root / 'b' / 'd')
+    index()
+    assert rollup(db) == (core.ObjectType.directory, 10, 1)
+    assert crud.get_object(db, 'b', 'd') is None
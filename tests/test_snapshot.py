@@ -0,0 +1,72 @@
+import pytest
+
+from umeta import core, snapshot
+from umeta.snapshot import Snapshot
+
+
+def file(key, size=1, modified=100, bucket='b'):
+    return core.Object(
+        bucket=bucket,
+        key=key,
+        type=core.ObjectType.file,
+        size=size,
+        modified=modified,
+    )
+
+
+@pytest.fixture
+def snap(monkeypatch):
+    # several runs, so sort has to merge them
+    monkeypatch.setattr(snapshot, 'SORT_RUN_SIZE', 3)
+    snap = Snapshot()
+    for i in range(10):
+        snap.add('b', f'f{i}', 100 + i, core.ObjectType.file, i, 1000 + i)
+    snap.add('b', None, 200, core.ObjectType.directory, 0, 0)
+    snap.sort()
+    return snap
+
+
+def test_sort(snap):
+    assert len(snap) == 11
+    assert list(snap.hashes) == sorted(snap.hashes)
+    # the columns are permuted together
+    for row, object_id in enumerate(snap.ids):
+        if object_id < 200:
+            assert snap.sizes[row] == object_id - 100
+            assert snap.modified[row] == object_id + 900
+    assert sorted(snap.ids) == list(range(100, 110)) + [200]
+    assert len(snap.matched) == 2
+
+
+def test_unchanged(snap):
+    assert snap.unchanged(file('f3', size=3, modified=1003)) == 103
+    assert snap.unchanged(file('f4', size=5, modified=1004)) is None
+    assert snap.unchanged(file('f5', size=5, modified=1)) is None
+    assert (
+        snap.unchanged(file('f6', size=6, modified=1006, bucket='c')) is None
+    )
+    assert snap.unchanged(file('f10', size=10, modified=1010)) is None
+    directory = core.Object(
+        bucket='b', key=None, type=core.ObjectType.directory
+    )
+    assert snap.unchanged(directory) == 200
+    # a directory is not the file of the same name
+    assert snap.unchanged(file(None, size=0, modified=0)) is None
+
+
+def test_seen(snap):
+    assert list(snap.seen()) == []
+    assert sorted(snap.unseen()) == sorted(snap.ids)
+    snap.unchanged(file('f0', size=0, modified=1000))
+    snap.unchanged(file('f9', size=9, modified=1009))
+    # a miss marks nothing
+    snap.unchanged(file('f1', size=2, modified=1001))
+    assert sorted(snap.seen()) == [100, 109]
+    assert sorted(snap.unseen()) == list(range(101, 109)) + [200]
+
+
+def test_empty():
+    snap = Snapshot()
+    snap.sort()
+    assert snap.unchanged(file('f0')) is None
+    assert list(snap.unseen()) == []
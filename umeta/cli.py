@@ -1,12 +1,20 @@
+import json
+import os
+import re
+import signal
+import time
 from dataclasses import asdict, dataclass
-from typing import Callable, Iterable, List, Union
+from datetime import datetime
+from typing import Callable, Iterable, List, Tuple, Union
 
 import click
 import sqlalchemy as sa
 
-from umeta import config, crud, generators, models, sources
+from umeta import config, core, crud, export, generators, models, sources
 from umeta.database import cli_get_db
 
+CONDITION_RE = re.compile(r'^([^=!<>]+)(=|!=|<=|>=|<|>)(.*)$')
+
 
 def get_sources(
     c: config.Config, name: Union[str, None]
@@ -26,46 +34,156 @@ def get_by(iter: Iterable[dataclass], key, value):
     return None
 
 
-def generate(c: config.Config, db: sa.orm.Session, name: str):
+def generate(
+    c: config.Config,
+    db: sa.orm.Session,
+    name: str,
+    order: str,
+    budget: core.Budget,
+):
     for s in get_sources(c, name):
-        outdated = crud.generate(db, s)
-        source_module = sources.get_module(s.type)
-        for gen_module, node, derivative, dependencies in outdated:
+        sources.throttle.ionice(s)
+        outdated = crud.generate(db, s, c.indexed_attributes, order, budget)
+        for node, derivative, error in outdated:
             try:
-                print(crud.get_path(db, node))
-            except ValueError as err:
+                path = crud.get_path(db, node)
+                if error is None:
+                    print(path)
+                else:
+                    click.echo(f'skipping {path}: {error!r}', err=True)
+            except Exception as err:
                 outdated.throw(err)
+    if budget.exhausted():
+        click.echo(
+            f'budget exhausted after {budget.items} item(s), '
+            'the next run will continue where this one stopped',
+            err=True,
+        )
 
 
-def index(c: config.Config, db: sa.orm.Session, name: str):
-    for s in get_sources(c, name):
-        if s is None:
-            click.echo(
-                message=f'Source name={name} not found in config.', err=True,
-            )
-            exit(1)
-        source_model, _ = crud.get_or_create(db, models.Source, name=s.name)
-        reindex = models.Reindex(source=source_model)
-        db.add(reindex)
-        db.add(source_model)
+def bulk_export(
+    db: sa.orm.Session,
+    url: str,
+    index: str,
+    full: bool,
+    **options,
+):
+    target = f'{url.rstrip("/")}/{index}'
+    export_model, revision_id, metadata_id, tombstone_id = crud.start_export(
+        db, target, full
+    )
+    deletions = crud.export_deletions(db, export_model, tombstone_id)
+    documents = crud.export_documents(
+        db, export_model, revision_id, metadata_id
+    )
+    deleted = 0
+    started = time.monotonic()
+    try:
+        # deletions are acknowledged before any document with a reused id
+        # is sent
+        for sent in export.export(deletions, url, index, **options):
+            deleted += sent
+        for sent in export.export(documents, url, index, **options):
+            export_model.documents += sent
+    except BaseException:
+        db.rollback()
+        export_model.status = core.ExportStatus.failed
+        raise
+    else:
+        export_model.status = core.ExportStatus.succeeded
+    finally:
+        export_model.ended = datetime.utcnow()
+        db.add(export_model)
         db.commit()
+    elapsed = time.monotonic() - started
+    click.echo(
+        f'exported {export_model.documents} document(s)'
+        f' and {deleted} deletion(s) to {target}'
+        f' in {elapsed:.1f}s'
+        f' ({export_model.documents / max(elapsed, 1e-9):.0f} docs/s)'
+    )
 
-        buckets = [
-            crud.upsert_object(db, b, {}, reindex, source_model)
-            for b in sources.get_module(s.type).scan_for_buckets(s)
-        ]
-        bucketnames = ' '.join([b.name for b in buckets])
-        click.echo(
-            f'reindexing {len(buckets)} bucket(s) from source={s.name}: {bucketnames}'
+
+def parse_condition(condition: str) -> Tuple[str, str, str]:
+    match = CONDITION_RE.match(condition)
+    if match is None:
+        raise click.BadParameter(
+            f'{condition} is not of the form KEY=VALUE, KEY>=VALUE, ...'
         )
-        nodes = []
-        for bucket in buckets:
-            nodes += crud.get_nodes(db, bucket)
-        with click.progressbar(
-            crud.index_source(db, s, reindex), length=len(nodes)
-        ) as bar:
-            for b in bar:
-                pass
+    return match.groups()
+
+
+def index(
+    c: config.Config,
+    db: sa.orm.Session,
+    name: str,
+    jobs: int = 1,
+    resume: bool = False,
+):
+    work = []
+    reindexes = {}
+    snapshots = {}
+    try:
+        for s in get_sources(c, name):
+            if s is None:
+                click.echo(
+                    message=f'Source name={name} not found in config.',
+                    err=True,
+                )
+                exit(1)
+            source_model, _ = crud.get_or_create(
+                db, models.Source, name=s.name
+            )
+            reindex = None
+            if resume:
+                reindex = crud.get_unfinished_reindex(db, source_model)
+            if reindex is None:
+                reindex = models.Reindex(source=source_model)
+            else:
+                click.echo(
+                    f'resuming reindex {reindex.id} of source={s.name}'
+                )
+                reindex.status = core.ReindexStatus.running
+                reindex.ended = None
+            checkpoint = reindex.checkpoint or {}
+            db.add(reindex)
+            db.add(source_model)
+            db.commit()
+            reindexes[s.name] = reindex
+
+            rollups, searchable = {}, []
+            buckets = [
+                crud.upsert_object(
+                    db, b, {}, reindex, source_model, rollups, searchable
+                )
+                for b in sources.get_module(s.type).scan_for_buckets(s)
+            ]
+            crud.add_to_search(db, searchable)
+            crud.apply_rollups(db, rollups)
+            db.commit()
+            bucketnames = ' '.join([b.name for b in buckets])
+            click.echo(
+                f'reindexing {len(buckets)} bucket(s) from source={s.name}:'
+                f' {bucketnames}'
+            )
+            for bucket in buckets:
+                work.append((s, bucket.name, checkpoint.get(bucket.name)))
+            snapshots[s.name] = crud.load_snapshot(db, source_model.id)
+    except BaseException:
+        # index_objects marks failures from here on
+        crud.fail_reindexes(db, reindexes.values())
+        raise
+
+    if jobs > 1:
+        objects = sources.index_buckets_parallel(work, jobs)
+    else:
+        objects = sources.index_buckets(work)
+    with click.progressbar(
+        crud.index_objects(db, objects, reindexes, snapshots),
+        length=sum(len(snapshot) for snapshot in snapshots.values()),
+    ) as bar:
+        for b in bar:
+            pass
 
 
 def list_buckets(
@@ -88,6 +206,34 @@ def do_crud(func: Callable, *args, **kwargs):
         exit(1)
 
 
+def report_rates(signum, frame):
+    for name, t in sources.throttle.throttles.items():
+        rates = t.rates()
+        click.echo(
+            f'{name}: {rates["stats_per_second"]:.1f} stat/s'
+            f' (limit {rates["stats_limit"]:g}),'
+            f' {rates["bytes_per_second"]:.0f} B/s'
+            f' (limit {rates["bytes_limit"]:g})',
+            err=True,
+        )
+
+
+def reload_limits(signum, frame):
+    try:
+        c = config.get_config()
+    except Exception as err:
+        click.echo(f'could not reload source limits: {err}', err=True)
+        return
+    sources.throttle.update_throttles(c.sources)
+    click.echo('reloaded source limits', err=True)
+
+
+def handle_throttle_signals():
+    # kill -USR1 reports current io rates, kill -HUP reloads limits
+    signal.signal(signal.SIGUSR1, report_rates)
+    signal.signal(signal.SIGHUP, reload_limits)
+
+
 @click.group()
 @click.pass_context
 def cli(ctx):
@@ -102,16 +248,48 @@ def cli(ctx):
 
 @click.command(name='generate', help='generate derivitaves')
 @click.option('--name', type=click.STRING, required=False, help='source name')
+@click.option(
+    '--order',
+    type=click.Choice(list(crud.GENERATE_ORDERS)),
+    default='id',
+    help='order to process objects in',
+)
+@click.option(
+    '--max-seconds',
+    type=click.FloatRange(min=0),
+    required=False,
+    help='stop after this many seconds',
+)
+@click.option(
+    '--max-items',
+    type=click.IntRange(min=0),
+    required=False,
+    help='stop after generating this many derivatives',
+)
 @click.pass_obj
-def _generate(ctx, name):
-    do_crud(generate, ctx['config'], ctx['db'], name)
+def _generate(ctx, name, order, max_seconds, max_items):
+    handle_throttle_signals()
+    budget = core.Budget(max_seconds=max_seconds, max_items=max_items)
+    do_crud(generate, ctx['config'], ctx['db'], name, order, budget)
 
 
 @click.command(name='index', help='index a source')
 @click.option('--name', type=click.STRING, required=False, help='source name')
+@click.option(
+    '--jobs',
+    type=click.IntRange(min=1),
+    default=1,
+    help='number of buckets to scan in parallel',
+)
+@click.option(
+    '--resume',
+    is_flag=True,
+    help='continue the latest unfinished reindex from its checkpoint',
+)
 @click.pass_obj
-def _index(ctx, name):
-    do_crud(index, ctx['config'], ctx['db'], name)
+def _index(ctx, name, jobs, resume):
+    handle_throttle_signals()
+    do_crud(index, ctx['config'], ctx['db'], name, jobs, resume)
 
 
 @click.command(name='ls')
@@ -124,6 +302,22 @@ def ls(ctx, bucket):
     click.echo(crud.get_nodes(db, b))
 
 
+@click.command(name='du', help='show the rolled up size of an object')
+@click.argument('bucket', type=click.STRING)
+@click.argument('key', type=click.STRING, required=False)
+@click.pass_obj
+def du(ctx, bucket, key):
+    obj = do_crud(crud.get_object, ctx['db'], bucket, key)
+    if obj is None:
+        click.echo(message=f'{bucket} {key or ""} not found.', err=True)
+        exit(1)
+    latest = datetime.utcfromtimestamp(obj.latest_modified)
+    click.echo(
+        f'{obj.total_size}\t{obj.file_count} file(s)\t'
+        f'latest {latest.isoformat()}'
+    )
+
+
 @click.command(name='list-buckets')
 @click.option(
     '--source-name', type=click.STRING, required=False, help='source name'
@@ -142,15 +336,149 @@ def _list_derivs(ctx):
     pass
 
 
+@click.command(name='search', help='search object names and paths')
+@click.argument('query', type=click.STRING)
+@click.option('--prefix', is_flag=True, help='match names by prefix')
+@click.option(
+    '--ext', type=click.STRING, required=False, help='file extension'
+)
+@click.option('--limit', type=click.IntRange(min=1), default=20)
+@click.option('--page', type=click.IntRange(min=1), default=1)
+@click.pass_obj
+def _search(ctx, query, prefix, ext, limit, page):
+    search_backend = crud.get_search_backend()
+    if search_backend is None:
+        click.echo(message='No search_backend configured.', err=True)
+        exit(1)
+    try:
+        hits = do_crud(
+            search_backend.search,
+            ctx['db'],
+            query,
+            prefix=prefix,
+            extension=ext,
+            limit=limit,
+            offset=(page - 1) * limit,
+        )
+    except ValueError as err:
+        click.echo(message=str(err), err=True)
+        exit(1)
+    for hit in hits:
+        click.echo(f'{hit.score:.3f}\t{hit.path}')
+
+
+@click.command(name='query', help='find objects by metadata attributes')
+@click.argument('conditions', nargs=-1, required=True)
+@click.option('--limit', type=click.IntRange(min=1), default=20)
+@click.option('--page', type=click.IntRange(min=1), default=1)
+@click.pass_obj
+def _query(ctx, conditions, limit, page):
+    c = ctx['config']
+    db = ctx['db']
+    parsed = [parse_condition(condition) for condition in conditions]
+    for key, _, _ in parsed:
+        if key not in c.indexed_attributes:
+            click.echo(
+                message=f'Attribute {key} is not in indexed_attributes.',
+                err=True,
+            )
+            exit(1)
+    objects = do_crud(
+        crud.query_attributes,
+        db,
+        parsed,
+        limit=limit,
+        offset=(page - 1) * limit,
+    )
+    for obj in objects:
+        path = crud.get_path(db, obj)
+        click.echo(os.path.join(path.bucket, path.key))
+
+
+@click.command(name='export', help='export objects and metadata in bulk')
+@click.option(
+    '--url',
+    type=click.STRING,
+    required=True,
+    help='elasticsearch compatible endpoint',
+)
+@click.option('--index', type=click.STRING, default='umeta')
+@click.option(
+    '--full', is_flag=True, help='export everything, not only changes'
+)
+@click.option('--batch-docs', type=click.IntRange(min=1), default=500)
+@click.option('--batch-bytes', type=click.IntRange(min=1), default=5242880)
+@click.option('--concurrency', type=click.IntRange(min=1), default=4)
+@click.option('--max-retries', type=click.IntRange(min=0), default=5)
+@click.option(
+    '--timeout',
+    type=click.FloatRange(min=1),
+    default=30,
+    help='seconds to wait for each _bulk response',
+)
+@click.pass_obj
+def _export(
+    ctx,
+    url,
+    index,
+    full,
+    batch_docs,
+    batch_bytes,
+    concurrency,
+    max_retries,
+    timeout,
+):
+    do_crud(
+        bulk_export,
+        ctx['db'],
+        url,
+        index,
+        full,
+        max_docs=batch_docs,
+        max_bytes=batch_bytes,
+        concurrency=concurrency,
+        max_retries=max_retries,
+        timeout=timeout,
+    )
+
+
+@click.command(name='changes', help='stream changes as json lines')
+@click.option(
+    '--since',
+    type=click.IntRange(min=0),
+    required=True,
+    help='reindex id; changes made by later reindexes are listed',
+)
+@click.option('--page-size', type=click.IntRange(min=1), default=500)
+@click.pass_obj
+def _changes(ctx, since, page_size):
+    changes = do_crud(crud.get_changes, ctx['db'], since, page_size)
+    for change in changes:
+        click.echo(json.dumps(change))
+
+
 @click.command(name='migrate', help='run datbase migrations')
 @click.pass_obj
 def migrate(ctx):
     engine = ctx['engine']
     models.Base.metadata.create_all(bind=engine)
+    crud.sync_attribute_indexes(ctx['db'], ctx['config'].indexed_attributes)
+    search_backend = crud.get_search_backend()
+    if search_backend is not None:
+        try:
+            search_backend.migrate(engine)
+        except ValueError as err:
+            click.echo(message=str(err), err=True)
+            exit(1)
 
 
 cli.add_command(_generate)
 cli.add_command(_index)
 cli.add_command(ls)
+cli.add_command(du)
 cli.add_command(_list_buckets)
+cli.add_command(_search)
+cli.add_command(_query)
+cli.add_command(_export)
+cli.add_command(_changes)
 cli.add_command(migrate)
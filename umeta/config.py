@@ -1,7 +1,7 @@
 import json
 import os
 from dataclasses import dataclass, field
-from typing import List, Optional, Union
+from typing import Dict, List, Optional, Union
 
 import marshmallow_dataclass
 
@@ -20,18 +20,36 @@ class Disk:
     root: str
 
 
+@dataclass
+class Limits:
+    # 0 means unlimited
+    stats_per_second: float = 0
+    bytes_per_second: float = 0
+    # ionice scheduling class: 1 realtime, 2 best-effort, 3 idle
+    ionice_class: Optional[int] = None
+
+
 @dataclass
 class Source:
     type: str
     name: Optional[str]
     generators: List[str]
     properties: Union[S3, Disk]
+    limits: Limits = field(default_factory=Limits)
+    # generator name -> priority, overriding the generator's own.  higher
+    # priorities run first, so they get the budget of a limited run.
+    priorities: Dict[str, int] = field(default_factory=dict)
 
 
 @dataclass
 class Config:
     database_uri: str = field(default='config/umeta.config.json')
     sources: List[Source] = field(default_factory=list)
+    # name of the search backend in umeta.search, or null to disable.
+    # sqlite needs a sqlite database with the fts5 trigram tokenizer.
+    search_backend: Optional[str] = field(default=None)
+    # metadata payload keys to index for `umeta query`
+    indexed_attributes: List[str] = field(default_factory=list)
 
 
 ConfigSchema = marshmallow_dataclass.class_schema(Config)
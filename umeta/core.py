@@ -1,6 +1,7 @@
 import enum
-from dataclasses import dataclass
-from typing import Any, List
+import time
+from dataclasses import dataclass, field
+from typing import Any, List, Optional
 
 
 class ObjectType(enum.Enum):
@@ -23,6 +24,14 @@ class GeneratorStatus(enum.Enum):
     running = 1
     succeeded = 2
     failed = 3
+    # stopped when its budget ran out, see Generator.checkpoint
+    partial = 4
+
+
+class ExportStatus(enum.Enum):
+    running = 1
+    succeeded = 2
+    failed = 3
 
 
 @dataclass
@@ -32,6 +41,9 @@ class Object:
     type: ObjectType = ObjectType.file
     modified: int = 0
     size: int = 0
+    # listed but could not be read.  the index keeps what it knew about the
+    # object and everything under it.
+    unreadable: bool = False
 
 @dataclass
 class Derivative:
@@ -39,3 +51,26 @@ class Derivative:
     type: DerivativeType
     name: str
     version: str
+
+
+@dataclass
+class Budget:
+    """
+    limits on a generate run.  None means unlimited.
+    """
+
+    max_seconds: Optional[float] = None
+    max_items: Optional[int] = None
+    items: int = 0
+    started: float = field(default_factory=time.monotonic)
+
+    def spend(self, items: int = 1):
+        self.items += items
+
+    def exhausted(self) -> bool:
+        return (
+            self.max_items is not None and self.items >= self.max_items
+        ) or (
+            self.max_seconds is not None
+            and time.monotonic() - self.started >= self.max_seconds
+        )
@@ -1,13 +1,62 @@
+import heapq
+import logging
+import operator
 import os
+import time
 from datetime import datetime
-from typing import Any, Dict, List, Tuple, Union
+from typing import (
+    Any,
+    BinaryIO,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
 from uuid import uuid4
 
 import sqlalchemy as sa
 from sqlalchemy.orm import Session, aliased
 from sqlalchemy.sql import label
 
-from umeta import config, core, generators, models, sources
+from umeta import config, core, generators, models, search, sources
+from umeta.snapshot import Snapshot
+
+logger = logging.getLogger(__name__)
+
+# objects upserted between commits during a reindex
+INDEX_BATCH_SIZE = 1000
+# seconds between commits of batches that only move the checkpoint
+CHECKPOINT_SECONDS = 10
+# ids per statement when deleting objects or marking them seen
+DELETE_BATCH_SIZE = 500
+# metadata payloads per bulk insert
+METADATA_BATCH_SIZE = 500
+# objects loaded per query when exporting documents
+EXPORT_BATCH_SIZE = 500
+
+# object id -> [size delta, file count delta, newest mtime] for the object
+# and all of its ancestors
+RollupDeltas = Dict[int, List[int]]
+
+ATTRIBUTE_OPERATORS = {
+    '=': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+
+def get_search_backend():
+    if config.config.search_backend is None:
+        return None
+    return search.get_module(config.config.search_backend)
 
 
 def get_buckets(db: Session, s: config.Source) -> List[models.Object]:
@@ -42,6 +91,34 @@ def get_path(db: Session, obj: models.Object) -> core.Object:
     )
 
 
+def get_object(
+    db: Session, bucket: str, key: str = None
+) -> Union[models.Object, None]:
+    obj_model = (
+        db.query(models.Object)
+        .filter(
+            sa.and_(
+                models.Object.name == bucket, models.Object.parent_id == None,
+            )
+        )
+        .first()
+    )
+    for name in [part for part in (key or '').split(os.sep) if part]:
+        if obj_model is None:
+            return None
+        obj_model = (
+            db.query(models.Object)
+            .filter(
+                sa.and_(
+                    models.Object.name == name,
+                    models.Object.parent_id == obj_model.id,
+                )
+            )
+            .first()
+        )
+    return obj_model
+
+
 def get_nodes(db: Session, root: models.Object, modified: datetime = None):
     hierarchy = (
         db.query(models.Object, sa.literal(0).label('level'))
@@ -64,17 +141,322 @@ def get_nodes(db: Session, root: models.Object, modified: datetime = None):
 
 
 def index_source(db: Session, s: config.Source, reindex: models.Reindex):
-    parent_cache = {}
-    for i, obj in enumerate(sources.get_module(s.type).index(s)):
-        if obj.key is not None:
-            upsert_object(db, obj, parent_cache, reindex)
-        yield i
-    reindex.ended = datetime.utcnow()
-    reindex.status = models.ReindexStatus.succeeded
-    db.add(reindex)
+    objects = ((s, obj) for obj in sources.get_module(s.type).index(s))
+    return index_objects(db, objects, {s.name: reindex})
+
+
+def get_unfinished_reindex(
+    db: Session, source: models.Source
+) -> Union[models.Reindex, None]:
+    latest: models.Reindex = (
+        db.query(models.Reindex)
+        .filter(models.Reindex.source_id == source.id)
+        .order_by(models.Reindex.created.desc())
+        .first()
+    )
+    if latest is None or latest.status == core.ReindexStatus.succeeded:
+        return None
+    return latest
+
+
+def index_objects(
+    db: Session,
+    objects: Iterator[Tuple[config.Source, core.Object]],
+    reindexes: Dict[str, models.Reindex],
+    snapshots: Dict[str, Snapshot] = None,
+    batch_size: int = INDEX_BATCH_SIZE,
+):
+    """
+    the single database writer for one or more (possibly concurrent) scans.
+    objects from different sources may be interleaved, but objects within
+    a bucket must arrive one directory listing at a time, parents first.
+    objects a snapshot of the source shows as unchanged are only recorded
+    in the snapshot's bitmap, so they cost no database work at all.
+    commits every batch_size objects, saving the last completed listing of
+    each bucket on its reindex.  batches with nothing to write only commit
+    their checkpoint every CHECKPOINT_SECONDS.
+
+    on success, snapshot objects that were neither matched nor upserted
+    are deleted, except under objects the scan reported unreadable.  on
+    any error the matched objects are marked seen, and the reindexes are
+    marked failed, keeping their last checkpoint.  a resumed reindex whose
+    marks were lost to a hard crash deletes nothing, leaving deletions to
+    the next full reindex.
+    """
+    parent_caches: Dict[str, Dict[str, models.Object]] = {
+        name: {} for name in reindexes
+    }
+    # source name -> bucket -> directory key currently being listed
+    listing: Dict[str, Dict[str, str]] = {name: {} for name in reindexes}
+    frontiers: Dict[str, Dict[str, str]] = {
+        name: dict(reindex.checkpoint or {})
+        for name, reindex in reindexes.items()
+    }
+    # a resumed run did not visit objects before its checkpoint, so it can
+    # only find deletions if the previous run's marks were saved
+    deletes: Dict[str, bool] = {
+        name: not reindex.checkpoint or reindex.seen_marked
+        for name, reindex in reindexes.items()
+    }
+    # (bucket, key) of objects the scan could not read
+    unreadable: Dict[str, List[Tuple[str, Optional[str]]]] = {
+        name: [] for name in reindexes
+    }
+    rollups: RollupDeltas = {}
+    # created objects not yet in the search index
+    searchable: List[Tuple[models.Object, str]] = []
+    for reindex in reindexes.values():
+        reindex.seen_marked = False
+        db.add(reindex)
+    # objects upserted since the last commit
+    upserted = 0
+    committed = 0.0
+    try:
+        if snapshots is None:
+            snapshots = {
+                name: load_snapshot(db, reindex.source_id)
+                for name, reindex in reindexes.items()
+            }
+        for i, (s, obj) in enumerate(objects):
+            if obj.unreadable:
+                unreadable[s.name].append((obj.bucket, obj.key))
+            elif obj.key is not None:
+                parent_key = os.path.dirname(obj.key)
+                current = listing[s.name].get(obj.bucket)
+                if current is not None and current != parent_key:
+                    frontiers[s.name][obj.bucket] = current
+                listing[s.name][obj.bucket] = parent_key
+                if snapshots[s.name].unchanged(obj) is None:
+                    upserted += 1
+                    upsert_object(
+                        db,
+                        obj,
+                        parent_caches[s.name],
+                        reindexes[s.name],
+                        rollups=rollups,
+                        searchable=searchable,
+                    )
+            if (i + 1) % batch_size == 0 and (
+                upserted or time.monotonic() - committed >= CHECKPOINT_SECONDS
+            ):
+                add_to_search(db, searchable)
+                searchable = []
+                apply_rollups(db, rollups)
+                for name, reindex in reindexes.items():
+                    reindex.checkpoint = dict(frontiers[name])
+                    db.add(reindex)
+                db.commit()
+                upserted, committed = 0, time.monotonic()
+            yield i
+        add_to_search(db, searchable)
+        apply_rollups(db, rollups)
+        db.flush()
+        for name, reindex in reindexes.items():
+            if deletes[name]:
+                kept = get_subtrees(db, unreadable[name])
+                unseen = get_unseen(db, reindex, snapshots[name].unseen())
+                unseen = [i for i in unseen if i not in kept]
+                delete_objects(db, unseen, reindex)
+            else:
+                logger.warning(
+                    'reindex %s resumed without the marks of its previous'
+                    ' run, deletions are left for the next full reindex',
+                    reindex.id,
+                )
+            reindex.ended = datetime.utcnow()
+            reindex.status = core.ReindexStatus.succeeded
+            reindex.checkpoint = None
+            reindex.seen_marked = True
+            db.add(reindex)
+        db.commit()
+    except BaseException:
+        db.rollback()
+        try:
+            for name, reindex in reindexes.items():
+                if snapshots is None or name not in snapshots:
+                    continue
+                seen = list(snapshots[name].seen())
+                seen += get_subtrees(db, unreadable[name])
+                mark_seen(db, seen, reindex)
+                reindex.seen_marked = True
+                db.add(reindex)
+            db.commit()
+        except Exception:
+            logger.exception('could not mark objects seen')
+        fail_reindexes(db, reindexes.values())
+        raise
+
+
+def fail_reindexes(db: Session, reindexes: Iterable[models.Reindex]):
+    """
+    roll back and mark reindexes failed, keeping their last checkpoint
+    """
+    db.rollback()
+    for reindex in reindexes:
+        reindex.ended = datetime.utcnow()
+        reindex.status = core.ReindexStatus.failed
+        db.add(reindex)
     db.commit()
 
 
+def load_snapshot(db: Session, source_id: int) -> Snapshot:
+    """
+    stream every object under a source into a snapshot with one query
+    """
+    hierarchy = (
+        db.query(
+            models.Object.id,
+            models.Object.type,
+            models.Object.size,
+            models.Object.modified,
+            models.Object.name.label('bucket'),
+            sa.cast(sa.null(), sa.String).label('key'),
+        )
+        .filter(models.Object.source_id == source_id)
+        .cte(name='hierarchy', recursive=True)
+    )
+    parent = aliased(hierarchy, name='p')
+    children = aliased(models.Object, name='c')
+    hierarchy = hierarchy.union_all(
+        db.query(
+            children.id,
+            children.type,
+            children.size,
+            children.modified,
+            parent.c.bucket,
+            sa.case(
+                [(parent.c.key == None, children.name)],
+                else_=parent.c.key + os.sep + children.name,
+            ),
+        ).filter(children.parent_id == parent.c.id)
+    )
+    snapshot = Snapshot()
+    rows = db.query(hierarchy).yield_per(INDEX_BATCH_SIZE)
+    for object_id, type, size, modified, bucket, key in rows:
+        snapshot.add(bucket, key, object_id, type, size, modified)
+    snapshot.sort()
+    return snapshot
+
+
+def mark_seen(db: Session, object_ids: List[int], reindex: models.Reindex):
+    for i in range(0, len(object_ids), DELETE_BATCH_SIZE):
+        db.query(models.Object).filter(
+            models.Object.id.in_(object_ids[i : i + DELETE_BATCH_SIZE])
+        ).update(
+            {models.Object.seen_reindex_id: reindex.id},
+            synchronize_session=False,
+        )
+
+
+def get_unseen(
+    db: Session, reindex: models.Reindex, object_ids: Iterable[int]
+) -> List[int]:
+    """
+    those of object_ids the reindex did not see.  objects it created,
+    changed or marked seen carry its id in seen_reindex_id.
+    """
+    object_ids = list(object_ids)
+    unseen = []
+    for i in range(0, len(object_ids), DELETE_BATCH_SIZE):
+        rows = db.query(models.Object.id).filter(
+            models.Object.id.in_(object_ids[i : i + DELETE_BATCH_SIZE]),
+            sa.or_(
+                models.Object.seen_reindex_id != reindex.id,
+                models.Object.seen_reindex_id == None,
+            ),
+        )
+        unseen += [object_id for object_id, in rows]
+    return unseen
+
+
+def get_subtrees(
+    db: Session, paths: List[Tuple[str, Optional[str]]]
+) -> Set[int]:
+    """
+    ids of the objects at (bucket, key) paths and all of their descendants
+    """
+    roots = [get_object(db, bucket, key) for bucket, key in paths]
+    roots = [root.id for root in roots if root is not None]
+    if not roots:
+        return set()
+    rows = db.execute(
+        sa.text(
+            'WITH RECURSIVE down(id) AS ('
+            ' SELECT id FROM object WHERE id IN :ids'
+            ' UNION'
+            ' SELECT o.id FROM object o JOIN down ON o.parent_id = down.id'
+            ') SELECT id FROM down'
+        ).bindparams(sa.bindparam('ids', expanding=True)),
+        {'ids': roots},
+    )
+    return set(object_id for object_id, in rows)
+
+
+def delete_objects(
+    db: Session, object_ids: List[int], reindex: models.Reindex
+):
+    """
+    delete objects along with their revisions, derivatives (and their
+    metadata) and dependencies, and drop them from the search index.
+    the rollups of each deleted subtree are subtracted from its surviving
+    ancestors, and a tombstone is left for each object.
+    """
+    deleted = set(object_ids)
+    rollups: RollupDeltas = {}
+    for i in range(0, len(object_ids), DELETE_BATCH_SIZE):
+        chunk = object_ids[i : i + DELETE_BATCH_SIZE]
+        paths = get_paths(db, chunk)
+        rows = db.query(
+            models.Object.id,
+            models.Object.parent_id,
+            models.Object.type,
+            models.Object.total_size,
+            models.Object.file_count,
+        ).filter(models.Object.id.in_(chunk))
+        tombstones = []
+        for object_id, parent_id, type, total_size, file_count in rows:
+            if parent_id is not None and parent_id not in deleted:
+                add_rollup(rollups, parent_id, -total_size, -file_count, 0)
+            tombstones.append(
+                {
+                    'object_id': object_id,
+                    'path': paths[object_id],
+                    'type': type,
+                    'reindex_id': reindex.id,
+                }
+            )
+        db.bulk_insert_mappings(models.Tombstone, tombstones)
+    for i in range(0, len(object_ids), DELETE_BATCH_SIZE):
+        chunk = object_ids[i : i + DELETE_BATCH_SIZE]
+        revisions = db.query(models.Revision.id).filter(
+            models.Revision.object_id.in_(chunk)
+        )
+        derivatives = db.query(models.Derivative.id).filter(
+            models.Derivative.object_id.in_(chunk)
+        )
+        db.query(models.Dependency).filter(
+            sa.or_(
+                models.Dependency.revision_id.in_(revisions.subquery()),
+                models.Dependency.derivative_id.in_(derivatives.subquery()),
+            )
+        ).delete(synchronize_session=False)
+        db.query(models.Attribute).filter(
+            models.Attribute.derivative_id.in_(derivatives.subquery())
+        ).delete(synchronize_session=False)
+        db.query(models.Metadata).filter(
+            models.Metadata.derivative_id.in_(derivatives.subquery())
+        ).delete(synchronize_session=False)
+        derivatives.delete(synchronize_session=False)
+        revisions.delete(synchronize_session=False)
+        db.query(models.Object).filter(models.Object.id.in_(chunk)).delete(
+            synchronize_session=False
+        )
+    apply_rollups(db, rollups)
+    search_backend = get_search_backend()
+    if search_backend is not None and object_ids:
+        search_backend.remove(db, object_ids)
+
+
 def get_parent(
     db: Session, obj: core.Object, cache: Dict[str, models.Object],
 ) -> models.Object:
@@ -129,8 +511,17 @@ def upsert_object(
     parent_cache: Dict[str, models.Object],
     reindex: models.Reindex,
     source: models.Source = None,
+    rollups: RollupDeltas = None,
+    searchable: List[Tuple[models.Object, str]] = None,
 ) -> models.Object:
+    """
+    created objects are queued on searchable, for add_to_search to index
+    in bulk.  without a queue they are indexed right away.
+    """
     is_bucket = obj.key is None
+    is_file = obj.type == core.ObjectType.file
+    if rollups is None:
+        rollups = {}
 
     name = obj.bucket if is_bucket else os.path.basename(obj.key)
     parent_id = None if is_bucket else get_parent(db, obj, parent_cache).id
@@ -147,7 +538,8 @@ def upsert_object(
     ).first()
 
     revised = False
-    if not obj_model:
+    created = not obj_model
+    if created:
         # need to create model
         # TODO: check for copy or move
         obj_model = models.Object(
@@ -158,17 +550,49 @@ def upsert_object(
             modified=obj.modified,
             reindex=reindex,
             seen_reindex=reindex,
+            created_reindex=reindex,
             source=source,
+            total_size=obj.size if is_file else 0,
+            file_count=1 if is_file else 0,
+            latest_modified=obj.modified,
         )
         revised = True
         db.add(obj_model)
         if obj.type == core.ObjectType.directory:
             db.flush()
+        if parent_id is not None:
+            add_rollup(
+                rollups,
+                parent_id,
+                obj.size if is_file else 0,
+                1 if is_file else 0,
+                obj.modified,
+            )
     elif (
         obj.type != obj_model.type
         or obj.modified != obj_model.modified
         or obj.size != obj_model.size
     ):
+        was_file = obj_model.type == core.ObjectType.file
+        if is_file or was_file:
+            # a file's own rollup changes, so its ancestors' do too.  a
+            # directory turned file keeps its old totals until the children
+            # are deleted, which subtracts them again.
+            size_delta = (obj.size if is_file else 0) - (
+                obj_model.size if was_file else 0
+            )
+            count_delta = int(is_file) - int(was_file)
+            obj_model.total_size += size_delta
+            obj_model.file_count += count_delta
+            obj_model.latest_modified = max(
+                obj_model.latest_modified, obj.modified
+            )
+            if parent_id is not None:
+                add_rollup(
+                    rollups, parent_id, size_delta, count_delta, obj.modified
+                )
+        else:
+            add_rollup(rollups, obj_model.id, 0, 0, obj.modified)
         obj_model.type = obj.type
         obj_model.size = obj.size
         obj_model.modified = obj.modified
@@ -179,9 +603,91 @@ def upsert_object(
         db.add(revision)
     obj_model.seen_reindex = reindex
     db.add(obj_model)
+    if created:
+        path = obj.bucket if is_bucket else os.path.join(obj.bucket, obj.key)
+        if searchable is None:
+            add_to_search(db, [(obj_model, path)])
+        else:
+            searchable.append((obj_model, path))
     return obj_model
 
 
+def add_to_search(db: Session, searchable: List[Tuple[models.Object, str]]):
+    """
+    index created objects, flushing once for all of their ids
+    """
+    search_backend = get_search_backend()
+    if search_backend is None or not searchable:
+        return
+    db.flush()
+    search_backend.add(
+        db, [(obj_model.id, path) for obj_model, path in searchable]
+    )
+
+
+def add_rollup(
+    rollups: RollupDeltas,
+    object_id: int,
+    size: int,
+    count: int,
+    modified: int,
+):
+    delta = rollups.setdefault(object_id, [0, 0, 0])
+    delta[0] += size
+    delta[1] += count
+    delta[2] = max(delta[2], modified)
+
+
+def get_ancestors(db: Session, object_ids: List[int]) -> Dict[int, int]:
+    """
+    parent_id of every given object and each of its ancestors
+    """
+    rows = db.execute(
+        sa.text(
+            'WITH RECURSIVE up(id, parent_id) AS ('
+            ' SELECT id, parent_id FROM object WHERE id IN :ids'
+            ' UNION'
+            ' SELECT o.id, o.parent_id FROM object o'
+            ' JOIN up ON o.id = up.parent_id'
+            ') SELECT id, parent_id FROM up'
+        ).bindparams(sa.bindparam('ids', expanding=True)),
+        {'ids': object_ids},
+    )
+    return dict(rows.fetchall())
+
+
+def apply_rollups(db: Session, rollups: RollupDeltas):
+    """
+    fold deltas up the parent chain and apply them with one relative
+    update per affected object.  newest mtimes only ever move forward.
+    """
+    if not rollups:
+        return
+    db.flush()
+    parents = get_ancestors(db, list(rollups))
+    totals: RollupDeltas = {}
+    for object_id, (size, count, modified) in rollups.items():
+        node = object_id
+        while node is not None:
+            add_rollup(totals, node, size, count, modified)
+            node = parents.get(node)
+    db.execute(
+        sa.text(
+            'UPDATE object SET'
+            ' total_size = total_size + :size,'
+            ' file_count = file_count + :count,'
+            ' latest_modified = CASE WHEN latest_modified < :modified'
+            ' THEN :modified ELSE latest_modified END'
+            ' WHERE id = :id'
+        ),
+        [
+            {'id': node, 'size': size, 'count': count, 'modified': modified}
+            for node, (size, count, modified) in totals.items()
+        ],
+    )
+    rollups.clear()
+
+
 def get_or_create(db: Session, model: object, defaults=None, **kwargs):
     existing = db.query(model).filter_by(**kwargs).first()
     if existing:
@@ -204,62 +710,226 @@ def latest_object_revision(db: Session, obj: models.Object) -> models.Revision:
     return result[0]
 
 
-def generate(
-    db: Session, s: config.Source
-) -> List[List[Tuple[str, models.Object, List[models.Object]]]]:
+# generate orders: object -> sort key.  keys end in the object id, so they
+# are unique and a partial run can resume after the last one it finished.
+GENERATE_ORDERS: Dict[str, Callable[[models.Object], list]] = {
+    'id': lambda node: [node.id],
+    'newest': lambda node: [-node.modified, node.id],
+    'smallest': lambda node: [node.size, node.id],
+}
+
+# (modified since, order, resume after key)
+GeneratePass = Tuple[int, str, Optional[list]]
+
+
+def get_generator_passes(
+    db: Session, source: models.Source, name: str, version: str, order: str
+) -> Tuple[List[int], List[GeneratePass]]:
+    """
+    work for the next run of a generator: ids of objects to retry, and
+    passes.  after a succeeded run, that is every object modified since it
+    started.  after a partial run, it is the objects that failed, then the
+    rest of that run's objects in that run's order, then every object
+    modified since the partial run started.
+    """
+    previous: models.Generator = (
+        db.query(models.Generator)
+        .filter(
+            sa.and_(
+                models.Generator.name == name,
+                models.Generator.version == version,
+                models.Generator.source_id == source.id,
+                models.Generator.status.in_(
+                    [
+                        core.GeneratorStatus.succeeded,
+                        core.GeneratorStatus.partial,
+                    ]
+                ),
+            )
+        )
+        .order_by(models.Generator.created.desc())
+        .first()
+    )
+    if previous is None:
+        return [], [(0, order, None)]
+    if previous.status == core.GeneratorStatus.succeeded:
+        return [], [(int(datetime.timestamp(previous.created)), order, None)]
+    checkpoint = previous.checkpoint
+    passes = [(checkpoint['since'], checkpoint['order'], checkpoint['after'])]
+    if checkpoint['pending_since'] is not None:
+        passes.append((checkpoint['pending_since'], order, None))
+    return checkpoint.get('failed', []), passes
 
+
+def generate(
+    db: Session,
+    s: config.Source,
+    keys: List[str],
+    order: str = 'id',
+    budget: Optional[core.Budget] = None,
+) -> Iterator[Tuple[models.Object, models.Derivative, Optional[Exception]]]:
+    """
+    generate outdated derivatives for each generator of a source, highest
+    priority generator first, and yield each one with the error that
+    skipped it, if any.  objects are taken in `order`.  metadata payloads
+    are stored, with their indexed `keys`, in the transaction that records
+    the run.  when the budget runs out the current generator run is
+    marked partial, with a checkpoint for the next run to continue from,
+    and no further generators are started.  a run that skipped objects is
+    also marked partial, so the next run retries them first.
+    """
+    budget = budget or core.Budget()
     source, buckets = get_buckets(db, s)
-    for name in s.generators:
+    source_module = sources.get_module(s.type)
+
+    def get_bytes(node: models.Object) -> BinaryIO:
+        return source_module.get_bytes(s, get_path(db, node))
+
+    def priority(name: str) -> int:
+        default = getattr(generators.get_module(name), 'Priority', 0)
+        return s.priorities.get(name, default)
+
+    for name in sorted(s.generators, key=priority, reverse=True):
+        if budget.exhausted():
+            return
         generator_module = generators.get_module(name)
         generator_module_version = generator_module.Version
+        retry, passes = get_generator_passes(
+            db, source, name, generator_module_version, order
+        )
         generator_model = models.Generator(
             name=name, version=generator_module_version, source=source,
         )
         db.add(generator_model)
         db.commit()
-        previous_generator: models.Generator = (
-            db.query(models.Generator)
-            .filter(
-                sa.and_(
-                    models.Generator.name == name,
-                    models.Generator.version == generator_module_version,
-                    models.Generator.status == core.GeneratorStatus.succeeded,
-                )
-            )
-            .order_by(models.Generator.created.desc())
-            .first()
-        )
+        started = int(datetime.timestamp(generator_model.created))
+
+        try:
+            metadata = []
+            failed: List[int] = []
+            done: Set[int] = set()
+
+            def stop(checkpoint: dict):
+                generator_model.checkpoint = checkpoint
+                generator_model.status = core.GeneratorStatus.partial
+                generator_model.ended = datetime.utcnow()
+                db.add(generator_model)
+                store_metadata(db, metadata, keys)
+                db.commit()
 
-        modified_since = 0
-        if previous_generator:
-            modified_since = int(
-                datetime.timestamp(previous_generator.created)
+            def run(node: models.Object):
+                nonlocal metadata
+                # TODO: if type of node is directory, pass children to checker as well.
+                derivs = generator_module.check(node, None)
+                if derivs is None:
+                    return
+                filtered = filter_outdated(db, generator_model, node, derivs)
+                for der_model, dependency_models in filtered:
+                    budget.spend()
+                    error = None
+                    if der_model.type == core.DerivativeType.metadata:
+                        try:
+                            payload = generator_module.get(
+                                node, dependency_models, get_bytes
+                            )
+                        except Exception as err:
+                            # e.g. removed since the last index
+                            error = err
+                            drop_dependencies(db, dependency_models)
+                            if node.id not in failed:
+                                failed.append(node.id)
+                        else:
+                            metadata.append((der_model, payload))
+                    if len(metadata) >= METADATA_BATCH_SIZE:
+                        store_metadata(db, metadata, keys)
+                        metadata = []
+                    yield (node, der_model, error)
+
+            # objects deleted since they failed are gone from the query
+            retry_nodes = (
+                db.query(models.Object)
+                .filter(models.Object.id.in_(retry))
+                .order_by(models.Object.id)
+                .all()
+                if retry
+                else []
             )
+            for j, node in enumerate(retry_nodes):
+                if budget.exhausted():
+                    since, pass_order, after = passes[0]
+                    pending_since = None
+                    if len(passes) > 1:
+                        pending_since = passes[1][0]
+                    stop(
+                        {
+                            'since': since,
+                            'order': pass_order,
+                            'after': after,
+                            'pending_since': pending_since,
+                            'failed': [n.id for n in retry_nodes[j:]]
+                            + failed,
+                        }
+                    )
+                    return
+                yield from run(node)
+                done.add(node.id)
 
-        try:
-            for b in buckets:
-                nodes = get_nodes(db, b, modified_since)
-                for node, _ in nodes:
-                    # TODO: if type of node is directory, pass children to checker as well.
-                    derivs = generator_module.check(node, None)
-                    if derivs is not None:
-                        filtered = filter_outdated(
-                            db, generator_model, node, derivs
+            for i, (modified_since, pass_order, after) in enumerate(passes):
+                key = GENERATE_ORDERS[pass_order]
+                nodes = [
+                    node
+                    for b in buckets
+                    for node, _ in get_nodes(db, b, modified_since)
+                    if node.id not in done
+                    and (after is None or key(node) > after)
+                ]
+                nodes.sort(key=key)
+                # objects modified since this time are left for the next run
+                pending_since = started
+                if i + 1 < len(passes):
+                    pending_since = passes[i + 1][0]
+                for node in nodes:
+                    if budget.exhausted():
+                        stop(
+                            {
+                                'since': modified_since,
+                                'order': pass_order,
+                                'after': after,
+                                'pending_since': pending_since,
+                                'failed': failed,
+                            }
                         )
-                        for der_model, dependency_models in filtered:
-                            yield (generator_module, node, der_model, dependency_models)
+                        return
+                    yield from run(node)
+                    after = key(node)
+                    done.add(node.id)
 
+            if failed:
+                # only the failed objects are left for the next run
+                stop(
+                    {
+                        'since': started,
+                        'order': order,
+                        'after': None,
+                        'pending_since': None,
+                        'failed': failed,
+                    }
+                )
+                return
             generator_model.status = core.GeneratorStatus.succeeded
             generator_model.ended = datetime.utcnow()
             db.add(generator_model)
+            store_metadata(db, metadata, keys)
             db.commit()
-        except:
+        except BaseException as err:
             db.rollback()
             generator_model.ended = datetime.utcnow()
             generator_model.status = core.GeneratorStatus.failed
             db.add(generator_model)
             db.commit()
-            raise Exception(f'generation exception for source {name}')
+            raise Exception(
+                f'generator {name} failed for source {s.name}'
+            ) from err
 
 
 def create_dependencies(
@@ -275,6 +945,18 @@ def create_dependencies(
     return ret
 
 
+def drop_dependencies(db: Session, dependencies: List[models.Dependency]):
+    """
+    forget the new dependencies of a derivative that could not be
+    generated, so it stays outdated and is tried again by a later run.
+    """
+    for dep in dependencies:
+        if dep in db.new:
+            db.expunge(dep)
+        else:
+            db.delete(dep)
+
+
 def filter_outdated(
     db: Session,
     generator: models.Generator,
@@ -331,6 +1013,359 @@ def filter_outdated(
                 yield (der_model, dependency_models)
 
 
+def attribute_rows(
+    derivative_id: int, payload: Dict[str, Any], keys: List[str]
+) -> List[Dict[str, Any]]:
+    rows = []
+    for key in keys:
+        value = payload.get(key)
+        if value is None or isinstance(value, (list, dict)):
+            continue
+        number = None
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            number = float(value)
+        rows.append(
+            {
+                'derivative_id': derivative_id,
+                'key': key,
+                'value': str(value),
+                'number': number,
+            }
+        )
+    return rows
+
+
+def store_metadata(
+    db: Session,
+    items: List[Tuple[models.Derivative, Dict[str, Any]]],
+    keys: List[str],
+):
+    """
+    replace the payloads of metadata derivatives, and their indexed
+    attributes, in bulk.
+    """
+    if not items:
+        return
+    db.flush()
+    ids = [derivative.id for derivative, _ in items]
+    db.query(models.Attribute).filter(
+        models.Attribute.derivative_id.in_(ids)
+    ).delete(synchronize_session=False)
+    db.query(models.Metadata).filter(
+        models.Metadata.derivative_id.in_(ids)
+    ).delete(synchronize_session=False)
+    db.bulk_insert_mappings(
+        models.Metadata,
+        [
+            {'derivative_id': derivative.id, 'payload': payload}
+            for derivative, payload in items
+        ],
+    )
+    rows = []
+    for derivative, payload in items:
+        rows += attribute_rows(derivative.id, payload, keys)
+    db.bulk_insert_mappings(models.Attribute, rows)
+
+
+def sync_attribute_indexes(db: Session, keys: List[str]):
+    """
+    drop attributes whose keys are no longer indexed, and backfill newly
+    declared keys from the stored payloads.
+    """
+    db.query(models.Attribute).filter(
+        ~models.Attribute.key.in_(keys)
+    ).delete(synchronize_session=False)
+    indexed = set(key for key, in db.query(models.Attribute.key).distinct())
+    missing = [key for key in keys if key not in indexed]
+    if missing:
+        rows = []
+        payloads = db.query(
+            models.Metadata.derivative_id, models.Metadata.payload
+        ).yield_per(METADATA_BATCH_SIZE)
+        for derivative_id, payload in payloads:
+            rows += attribute_rows(derivative_id, payload, missing)
+            if len(rows) >= METADATA_BATCH_SIZE:
+                db.bulk_insert_mappings(models.Attribute, rows)
+                rows = []
+        db.bulk_insert_mappings(models.Attribute, rows)
+    db.commit()
+
+
+def query_attributes(
+    db: Session,
+    conditions: List[Tuple[str, str, str]],
+    limit: int = 20,
+    offset: int = 0,
+) -> List[models.Object]:
+    """
+    objects whose metadata matches every (key, operator, value) condition.
+    values that parse as numbers are compared numerically against numeric
+    attributes, and as strings against the rest.
+    """
+    q = db.query(models.Object).join(
+        models.Derivative, models.Derivative.object_id == models.Object.id
+    )
+    for key, op, value in conditions:
+        attribute = aliased(models.Attribute)
+        compare = ATTRIBUTE_OPERATORS[op]
+        match = sa.and_(
+            attribute.number == None, compare(attribute.value, value)
+        )
+        try:
+            match = sa.or_(compare(attribute.number, float(value)), match)
+        except ValueError:
+            pass
+        q = q.join(
+            attribute, attribute.derivative_id == models.Derivative.id
+        ).filter(attribute.key == key, match)
+    return (
+        q.distinct()
+        .order_by(models.Object.id)
+        .limit(limit)
+        .offset(offset)
+        .all()
+    )
+
+
+def changed_pages(
+    db: Session,
+    model: Union[models.Object, models.Tombstone],
+    since: int,
+    page_size: int,
+    until: Optional[int] = None,
+) -> Iterator[list]:
+    """
+    rows of model with since < reindex_id < until in (reindex_id, id)
+    order, one page at a time.  each page is at most two seeks on the
+    model's (reindex_id, id) index, so cost follows the number of changes.
+    """
+    last_reindex, last_id = since, None
+    while True:
+        page = []
+        if last_id is not None:
+            page = (
+                db.query(model)
+                .filter(model.reindex_id == last_reindex, model.id > last_id)
+                .order_by(model.id)
+                .limit(page_size)
+                .all()
+            )
+        if len(page) < page_size:
+            q = db.query(model).filter(model.reindex_id > last_reindex)
+            if until is not None:
+                q = q.filter(model.reindex_id < until)
+            page += (
+                q.order_by(model.reindex_id, model.id)
+                .limit(page_size - len(page))
+                .all()
+            )
+        if not page:
+            return
+        yield page
+        last_reindex, last_id = page[-1].reindex_id, page[-1].id
+
+
+def get_changes(
+    db: Session, since: int, page_size: int = EXPORT_BATCH_SIZE
+) -> Iterator[Dict[str, Any]]:
+    """
+    objects added, modified and deleted by reindexes after `since`, in
+    reindex order, with deletions first within a reindex.  stops before the
+    first reindex that is not finished: running, or failed and still the
+    latest of its source, so `index --resume` may add to it.  a consumer
+    can then resume from the highest reindex it has seen without missing
+    the rest of that reindex.
+    """
+    later = aliased(models.Reindex)
+    until = (
+        db.query(sa.func.min(models.Reindex.id))
+        .filter(
+            models.Reindex.id > since,
+            models.Reindex.status != core.ReindexStatus.succeeded,
+            ~sa.exists().where(
+                sa.and_(
+                    later.source_id == models.Reindex.source_id,
+                    later.id > models.Reindex.id,
+                )
+            ),
+        )
+        .scalar()
+    )
+
+    def updates() -> Iterator[Dict[str, Any]]:
+        pages = changed_pages(db, models.Object, since, page_size, until)
+        for page in pages:
+            paths = get_paths(db, [obj.id for obj in page])
+            for obj in page:
+                yield {
+                    'change': (
+                        'added'
+                        if obj.created_reindex_id > since
+                        else 'modified'
+                    ),
+                    'id': obj.id,
+                    'path': paths[obj.id],
+                    'type': obj.type.name,
+                    'size': obj.size,
+                    'modified': obj.modified,
+                    'reindex': obj.reindex_id,
+                }
+
+    def deletions() -> Iterator[Dict[str, Any]]:
+        pages = changed_pages(db, models.Tombstone, since, page_size, until)
+        for page in pages:
+            for tombstone in page:
+                yield {
+                    'change': 'deleted',
+                    'id': tombstone.object_id,
+                    'path': tombstone.path,
+                    'type': tombstone.type.name,
+                    'reindex': tombstone.reindex_id,
+                }
+
+    return heapq.merge(
+        deletions(),
+        updates(),
+        key=lambda change: (change['reindex'], change['change'] != 'deleted'),
+    )
+
+
+def start_export(
+    db: Session, target: str, full: bool = False
+) -> Tuple[models.Export, int, int, int]:
+    """
+    begin an export to target, returning it with the revision, metadata and
+    tombstone watermarks of the last successful export (0 for a full
+    export).  the new export's watermarks are the current maximum ids.
+    """
+    previous: models.Export = (
+        db.query(models.Export)
+        .filter(
+            sa.and_(
+                models.Export.target == target,
+                models.Export.status == core.ExportStatus.succeeded,
+            )
+        )
+        .order_by(models.Export.created.desc())
+        .first()
+    )
+    revision_id, metadata_id, tombstone_id = 0, 0, 0
+    if previous is not None and not full:
+        revision_id = previous.revision_id
+        metadata_id = previous.metadata_id
+        tombstone_id = previous.tombstone_id
+    export = models.Export(
+        target=target,
+        revision_id=db.query(sa.func.max(models.Revision.id)).scalar() or 0,
+        metadata_id=db.query(sa.func.max(models.Metadata.id)).scalar() or 0,
+        tombstone_id=db.query(sa.func.max(models.Tombstone.id)).scalar() or 0,
+    )
+    db.add(export)
+    db.commit()
+    return export, revision_id, metadata_id, tombstone_id
+
+
+def get_paths(db: Session, object_ids: List[int]) -> Dict[int, str]:
+    """
+    full bucket/key paths of objects, walking up from each object only
+    """
+    rows = db.execute(
+        sa.text(
+            'WITH RECURSIVE up(id, parent_id, path) AS ('
+            ' SELECT id, parent_id, name FROM object WHERE id IN :ids'
+            ' UNION ALL'
+            ' SELECT up.id, o.parent_id, o.name || :sep || up.path'
+            ' FROM up JOIN object o ON o.id = up.parent_id'
+            ') SELECT id, path FROM up WHERE parent_id IS NULL'
+        ).bindparams(sa.bindparam('ids', expanding=True)),
+        {'ids': object_ids, 'sep': os.sep},
+    )
+    return dict(rows.fetchall())
+
+
+def export_deletions(
+    db: Session, export: models.Export, tombstone_id: int
+) -> Iterator[Tuple[int, None]]:
+    """
+    (object id, None) for every object deleted since the given watermark,
+    up to the export's own.  ids may have been reused by objects created
+    since, so deletions go out before documents.
+    """
+    deleted = (
+        db.query(models.Tombstone.object_id)
+        .filter(
+            models.Tombstone.id > tombstone_id,
+            models.Tombstone.id <= export.tombstone_id,
+        )
+        .distinct()
+        .order_by(models.Tombstone.object_id)
+    )
+    for object_id, in deleted.yield_per(EXPORT_BATCH_SIZE):
+        yield object_id, None
+
+
+def export_documents(
+    db: Session, export: models.Export, revision_id: int, metadata_id: int,
+) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """
+    (object id, document) for every object with a revision or metadata
+    newer than the given watermarks, up to the export's own watermarks.
+    """
+    changed = (
+        db.query(models.Revision.object_id.label('id'))
+        .filter(
+            models.Revision.id > revision_id,
+            models.Revision.id <= export.revision_id,
+        )
+        .union(
+            db.query(models.Derivative.object_id)
+            .join(
+                models.Metadata,
+                models.Metadata.derivative_id == models.Derivative.id,
+            )
+            .filter(
+                models.Metadata.id > metadata_id,
+                models.Metadata.id <= export.metadata_id,
+            )
+        )
+        .subquery()
+    )
+    ids = [
+        object_id
+        for object_id, in db.query(changed.c.id).order_by(changed.c.id)
+    ]
+    for i in range(0, len(ids), EXPORT_BATCH_SIZE):
+        chunk = ids[i : i + EXPORT_BATCH_SIZE]
+        paths = get_paths(db, chunk)
+        metadata: Dict[int, Dict[str, Any]] = {}
+        payloads = (
+            db.query(
+                models.Derivative.object_id,
+                models.Derivative.name,
+                models.Metadata.payload,
+            )
+            .join(
+                models.Metadata,
+                models.Metadata.derivative_id == models.Derivative.id,
+            )
+            .filter(models.Derivative.object_id.in_(chunk))
+        )
+        for object_id, name, payload in payloads:
+            metadata.setdefault(object_id, {})[name] = payload
+        objects = db.query(models.Object).filter(models.Object.id.in_(chunk))
+        for obj in objects.order_by(models.Object.id):
+            bucket, _, key = paths[obj.id].partition(os.sep)
+            yield obj.id, {
+                'bucket': bucket,
+                'key': key or None,
+                'name': obj.name,
+                'type': obj.type.name,
+                'size': obj.size,
+                'modified': obj.modified,
+                'metadata': metadata.get(obj.id, {}),
+            }
+
+
 def recompute(
     db: Session,
     outdated_deriv: models.Derivative,
@@ -0,0 +1,155 @@
+import json
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import requests
+
+# bulk item statuses worth sending again
+RETRY_STATUSES = (429, 502, 503, 504)
+# request failures worth sending again
+RETRY_ERRORS = (
+    requests.ConnectionError,
+    requests.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+)
+
+
+class ExportError(Exception):
+    pass
+
+
+def batches(
+    documents: Iterator[Tuple[int, Optional[Dict[str, Any]]]],
+    index: str,
+    max_docs: int,
+    max_bytes: int,
+) -> Iterator[List[bytes]]:
+    """
+    group documents into _bulk bodies of at most max_docs documents or
+    max_bytes bytes, whichever comes first.  each item is one action line
+    and one source line, or a lone delete action for a None document.
+    """
+    batch, size = [], 0
+    for object_id, document in documents:
+        if document is None:
+            action = {'delete': {'_index': index, '_id': str(object_id)}}
+            item = f'{json.dumps(action)}\n'.encode()
+        else:
+            action = {'index': {'_index': index, '_id': str(object_id)}}
+            item = f'{json.dumps(action)}\n{json.dumps(document)}\n'
+            item = item.encode()
+        if batch and size + len(item) > max_bytes:
+            yield batch
+            batch, size = [], 0
+        batch.append(item)
+        size += len(item)
+        if len(batch) >= max_docs:
+            yield batch
+            batch, size = [], 0
+    if batch:
+        yield batch
+
+
+_local = threading.local()
+
+
+def send(
+    url: str,
+    batch: List[bytes],
+    max_retries: int,
+    backoff: float,
+    timeout: float,
+) -> int:
+    """
+    post one _bulk body, retrying failed or timed out requests and
+    retriable items with exponential backoff.  returns the number of
+    documents sent.
+    """
+    if not hasattr(_local, 'session'):
+        _local.session = requests.Session()
+    pending = batch
+    for attempt in range(max_retries + 1):
+        if attempt:
+            delay = backoff * 2 ** (attempt - 1)
+            time.sleep(delay * random.uniform(0.5, 1.5))
+        try:
+            response = _local.session.post(
+                f'{url}/_bulk',
+                data=b''.join(pending),
+                headers={'Content-Type': 'application/x-ndjson'},
+                timeout=timeout,
+            )
+        except RETRY_ERRORS as err:
+            error = str(err)
+            continue
+        if response.status_code in RETRY_STATUSES:
+            error = f'HTTP {response.status_code}'
+            continue
+        if response.status_code >= 400:
+            raise ExportError(
+                f'HTTP {response.status_code}: {response.text[:200]}'
+            )
+        result = response.json()
+        if not result.get('errors'):
+            return len(batch)
+        retry = []
+        for item, line in zip(result['items'], pending):
+            action, outcome = next(iter(item.items()))
+            status = outcome.get('status', 200)
+            if status in RETRY_STATUSES:
+                retry.append(line)
+            elif status == 404 and action == 'delete':
+                # already gone, e.g. never exported
+                continue
+            elif status >= 400:
+                raise ExportError(f'{status}: {outcome}')
+        error = f'{len(retry)} item(s) rejected'
+        pending = retry
+        if not pending:
+            return len(batch)
+    raise ExportError(f'giving up after {max_retries} retries: {error}')
+
+
+def export(
+    documents: Iterator[Tuple[int, Optional[Dict[str, Any]]]],
+    url: str,
+    index: str,
+    max_docs: int = 500,
+    max_bytes: int = 5 * 1024 * 1024,
+    concurrency: int = 4,
+    max_retries: int = 5,
+    backoff: float = 0.5,
+    timeout: float = 30,
+) -> Iterator[int]:
+    """
+    stream documents to an elasticsearch compatible _bulk endpoint, with up
+    to `concurrency` requests in flight.  a None document deletes its id.
+    batches may be acknowledged out of order, so an id should not appear
+    twice in one call.  documents are not pulled from the iterator while
+    all requests are busy.  yields the number of documents in each
+    acknowledged batch.
+    """
+    url = url.rstrip('/')
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        in_flight = set()
+        try:
+            for batch in batches(documents, index, max_docs, max_bytes):
+                if len(in_flight) >= concurrency:
+                    done, in_flight = wait(
+                        in_flight, return_when=FIRST_COMPLETED
+                    )
+                    for future in done:
+                        yield future.result()
+                in_flight.add(
+                    pool.submit(
+                        send, url, batch, max_retries, backoff, timeout
+                    )
+                )
+            for future in in_flight:
+                yield future.result()
+        finally:
+            for future in in_flight:
+                future.cancel()
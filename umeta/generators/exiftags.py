@@ -1,16 +1,22 @@
-from PIL import ExifTags
+import math
+from typing import Any, Dict
+
+from PIL import ExifTags, Image
 
 from umeta import core, models
-from umeta.sources.utils import GetBytesType
-from .utils import CheckReturnType, ChildrenArgType
+from .utils import CheckReturnType, ChildrenArgType, GetObjectBytesType
 
 
 Version = '0.0.1'
+# generators with higher priorities run first
+Priority = 0
 ObjectTypes = (core.ObjectType.file,)
 Extensions = (
     '.jpg',
     '.tif',
 )
+# pointer to the exif sub-ifd, which holds capture date, exposure, etc.
+ExifIFD = 0x8769
 
 
 def check(
@@ -30,9 +36,39 @@ def check(
     return None
 
 
+def to_json(value: Any) -> Any:
+    if isinstance(value, (tuple, list)):
+        return [to_json(v) for v in value]
+    if isinstance(value, str):
+        return value.strip('\x00')
+    if isinstance(value, int):
+        return value
+    try:
+        number = float(value)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+    return number if math.isfinite(number) else None
+
+
 def get(
     object: models.Object,
     dependencies: ChildrenArgType,
-    get_bytes: GetBytesType,
-):
-    pass
+    get_bytes: GetObjectBytesType,
+) -> Dict[str, Any]:
+    try:
+        with get_bytes(object) as f, Image.open(f) as image:
+            exif = image.getexif()
+            tags = dict(exif)
+            if hasattr(exif, 'get_ifd'):
+                tags.update(exif.get_ifd(ExifIFD))
+    except Image.UnidentifiedImageError:
+        # named like an image, but isn't one
+        return {}
+    payload = {}
+    for tag, value in tags.items():
+        if tag == ExifIFD or isinstance(value, bytes):
+            continue
+        value = to_json(value)
+        if value is not None:
+            payload[ExifTags.TAGS.get(tag, str(tag))] = value
+    return payload
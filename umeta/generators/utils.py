@@ -1,6 +1,8 @@
-from typing import Callable, List, Union
+from typing import BinaryIO, Callable, List, Union
 
 from umeta import core, models
 
 ChildrenArgType = Union[List[models.Object], None]
 CheckReturnType = Union[List[core.Derivative], None]
+# a source's get_bytes, bound to the source being generated
+GetObjectBytesType = Callable[[models.Object], BinaryIO]
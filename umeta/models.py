@@ -1,6 +1,7 @@
 import sqlalchemy as sa
 from umeta.core import (
     DerivativeType,
+    ExportStatus,
     GeneratorStatus,
     ObjectType,
     ReindexStatus,
@@ -21,6 +22,9 @@ class Generator(Base):
         nullable=False,
         default=GeneratorStatus.running,
     )
+    # where a partial run stopped and which objects failed, see
+    # crud.get_generator_passes
+    checkpoint = sa.Column(sa.JSON, nullable=True)
     source_id = sa.Column(sa.Integer, sa.ForeignKey(Source.id), nullable=False)
     source = sa.orm.relationship('Source')
 
@@ -30,22 +34,45 @@ class Reindex(Base):
     status = sa.Column(
         sa.Enum(ReindexStatus), nullable=False, default=ReindexStatus.running
     )
+    # bucket name -> last fully indexed directory key, for resuming
+    checkpoint = sa.Column(sa.JSON, nullable=True)
+    # whether every object the reindex matched to its snapshot before it
+    # stopped is marked seen, so a resumed run can still find deletions
+    seen_marked = sa.Column(sa.Boolean, nullable=False, default=True)
     source_id = sa.Column(sa.Integer, sa.ForeignKey(Source.id), nullable=False)
     source = sa.orm.relationship('Source')
 
 
 class Object(Base):
-    __table_args__ = (sa.UniqueConstraint('name', 'parent_id'),)
+    __table_args__ = (
+        sa.UniqueConstraint('name', 'parent_id'),
+        # keyset order of the change feed
+        sa.Index('ix_object_reindex_id_id', 'reindex_id', 'id'),
+    )
     type = sa.Column(sa.Enum(ObjectType), nullable=False)
     name = sa.Column(sa.String, nullable=False)
     modified = sa.Column(sa.Integer, nullable=False)
     size = sa.Column(sa.Integer, nullable=False)
 
+    # rollups over the object and everything below it, kept up to date
+    # incrementally.  a file counts itself; directory sizes are not counted.
+    total_size = sa.Column(sa.BigInteger, nullable=False, default=0)
+    file_count = sa.Column(sa.Integer, nullable=False, default=0)
+    latest_modified = sa.Column(sa.Integer, nullable=False, default=0)
+
     parent_id = sa.Column(
         sa.Integer, sa.ForeignKey('object.id'), nullable=True
     )
     parent = sa.orm.relationship('Object', remote_side='Object.id')
 
+    # the reindex where object was first seen
+    created_reindex_id = sa.Column(
+        sa.Integer, sa.ForeignKey(Reindex.id), nullable=False
+    )
+    created_reindex = sa.orm.relationship(
+        'Reindex', foreign_keys='Object.created_reindex_id'
+    )
+
     # the last reindex where object was modified
     reindex_id = sa.Column(
         sa.Integer, sa.ForeignKey(Reindex.id), nullable=False
@@ -65,6 +92,21 @@ class Object(Base):
     source = sa.orm.relationship('Source')
 
 
+class Tombstone(Base):
+    # an object deleted by a reindex, kept for the change feed
+    __table_args__ = (
+        sa.Index('ix_tombstone_reindex_id_id', 'reindex_id', 'id'),
+    )
+    object_id = sa.Column(sa.Integer, nullable=False)
+    path = sa.Column(sa.String, nullable=False)
+    type = sa.Column(sa.Enum(ObjectType), nullable=False)
+
+    reindex_id = sa.Column(
+        sa.Integer, sa.ForeignKey(Reindex.id), nullable=False
+    )
+    reindex = sa.orm.relationship('Reindex')
+
+
 class Revision(Base):
     object_id = sa.Column(sa.Integer, sa.ForeignKey(Object.id), nullable=False)
     object = sa.orm.relationship('Object')
@@ -85,6 +127,33 @@ class Derivative(Base):
     object = sa.orm.relationship('Object', backref='metadata', lazy=True)
 
 
+class Metadata(Base):
+    # the full payload of a metadata derivative
+    payload = sa.Column(sa.JSON, nullable=False)
+
+    derivative_id = sa.Column(
+        sa.Integer, sa.ForeignKey(Derivative.id), nullable=False, unique=True
+    )
+    derivative = sa.orm.relationship('Derivative')
+
+
+class Attribute(Base):
+    # one scalar payload value, only for keys in config.indexed_attributes
+    __table_args__ = (
+        sa.Index('ix_attribute_key_value', 'key', 'value'),
+        sa.Index('ix_attribute_key_number', 'key', 'number'),
+    )
+    key = sa.Column(sa.String, nullable=False)
+    value = sa.Column(sa.String, nullable=False)
+    # numeric values are also stored as numbers for range queries
+    number = sa.Column(sa.Float, nullable=True)
+
+    derivative_id = sa.Column(
+        sa.Integer, sa.ForeignKey(Derivative.id), nullable=False, index=True
+    )
+    derivative = sa.orm.relationship('Derivative')
+
+
 class Dependency(Base):
     __table_args__ = (sa.UniqueConstraint('revision_id', 'derivative_id'),)
     revision_id = sa.Column(
@@ -96,3 +165,18 @@ class Dependency(Base):
         sa.Integer, sa.ForeignKey(Derivative.id), nullable=False
     )
     derivative = sa.orm.relationship('Derivative')
+
+
+class Export(Base):
+    # where documents were sent, e.g. http://localhost:9200/umeta
+    target = sa.Column(sa.String, nullable=False, index=True)
+    ended = sa.Column(sa.DateTime, nullable=True)
+    status = sa.Column(
+        sa.Enum(ExportStatus), nullable=False, default=ExportStatus.running
+    )
+    documents = sa.Column(sa.Integer, nullable=False, default=0)
+    # watermarks: revisions, metadata and tombstones up to these ids are
+    # exported
+    revision_id = sa.Column(sa.Integer, nullable=False, default=0)
+    metadata_id = sa.Column(sa.Integer, nullable=False, default=0)
+    tombstone_id = sa.Column(sa.Integer, nullable=False, default=0)
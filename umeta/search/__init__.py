@@ -0,0 +1,16 @@
+from typing import Any, Dict
+
+from . import sqlite
+
+# every backend module provides:
+#   migrate(engine)                      create (and backfill) the index
+#   add(db, objects)                     index new (object_id, path)s
+#   remove(db, object_ids)               drop objects from the index
+#   search(db, query, prefix, extension, limit, offset) -> List[Hit]
+backends: Dict[str, Any] = {
+    'sqlite': sqlite,
+}
+
+
+def get_module(name: str):
+    return backends[name]
@@ -0,0 +1,196 @@
+import os
+from typing import List, Tuple
+
+import sqlalchemy as sa
+from sqlalchemy.orm import Session
+
+from .utils import Hit, get_extension, normalize_extension
+
+# fts5 table over object names and full paths (bucket/key).  the trigram
+# tokenizer answers any substring of three or more characters from the
+# index.  object ids are used as rowids.
+TABLE = 'object_search'
+# indexed names and extensions, for what trigrams cannot answer: extension
+# filters and name prefixes shorter than three characters.
+NAMES_TABLE = 'object_search_name'
+BACKFILL_BATCH_SIZE = 10000
+MIN_SUBSTRING = 3
+
+
+def _exists(conn: sa.engine.Connection, name: str) -> bool:
+    row = conn.execute(
+        sa.text('SELECT 1 FROM sqlite_master WHERE name = :name'),
+        name=name,
+    ).first()
+    return row is not None
+
+
+def migrate(engine: sa.engine.Engine):
+    if engine.dialect.name != 'sqlite':
+        raise ValueError('sqlite search backend requires a sqlite database')
+    with engine.begin() as conn:
+        if not _exists(conn, TABLE):
+            try:
+                _create_search(conn)
+            except sa.exc.OperationalError as err:
+                raise ValueError(
+                    'sqlite search backend requires SQLite 3.34+ with the'
+                    f' fts5 trigram tokenizer ({err.orig}), set'
+                    ' search_backend to null to disable search'
+                ) from err
+        if not _exists(conn, NAMES_TABLE):
+            _create_names(conn)
+
+
+def _create_search(conn: sa.engine.Connection):
+    conn.execute(
+        f'CREATE VIRTUAL TABLE {TABLE} USING fts5('
+        "name, path, ext UNINDEXED, tokenize='trigram')"
+    )
+    rows = conn.execute(
+        sa.text(
+            'WITH RECURSIVE paths(id, path) AS ('
+            ' SELECT id, name FROM object WHERE parent_id IS NULL'
+            ' UNION ALL'
+            ' SELECT o.id, p.path || :sep || o.name'
+            ' FROM object o JOIN paths p ON o.parent_id = p.id'
+            ') SELECT id, path FROM paths'
+        ),
+        sep=os.sep,
+    )
+    while True:
+        batch = rows.fetchmany(BACKFILL_BATCH_SIZE)
+        if not batch:
+            break
+        conn.execute(
+            sa.text(
+                f'INSERT INTO {TABLE}(rowid, name, path, ext)'
+                ' VALUES (:id, :name, :path, :ext)'
+            ),
+            [_row(object_id, path) for object_id, path in batch],
+        )
+
+
+def _create_names(conn: sa.engine.Connection):
+    # ids are rowids, so both indexes are also in id order
+    conn.execute(
+        f'CREATE TABLE {NAMES_TABLE}(id INTEGER PRIMARY KEY,'
+        ' name TEXT NOT NULL COLLATE NOCASE, ext TEXT NOT NULL)'
+    )
+    conn.execute(f'CREATE INDEX ix_{NAMES_TABLE}_name ON {NAMES_TABLE}(name)')
+    conn.execute(f'CREATE INDEX ix_{NAMES_TABLE}_ext ON {NAMES_TABLE}(ext)')
+    conn.execute(
+        f'INSERT INTO {NAMES_TABLE}(id, name, ext)'
+        f' SELECT rowid, name, ext FROM {TABLE}'
+    )
+
+
+def _row(object_id: int, path: str) -> dict:
+    return {
+        'id': object_id,
+        'name': os.path.basename(path),
+        'path': path,
+        'ext': get_extension(path),
+    }
+
+
+def add(db: Session, objects: List[Tuple[int, str]]):
+    if not objects:
+        return
+    rows = [_row(object_id, path) for object_id, path in objects]
+    db.execute(
+        sa.text(
+            f'INSERT INTO {TABLE}(rowid, name, path, ext)'
+            ' VALUES (:id, :name, :path, :ext)'
+        ),
+        rows,
+    )
+    db.execute(
+        sa.text(
+            f'INSERT INTO {NAMES_TABLE}(id, name, ext)'
+            ' VALUES (:id, :name, :ext)'
+        ),
+        rows,
+    )
+
+
+def remove(db: Session, object_ids: List[int]):
+    for i in range(0, len(object_ids), BACKFILL_BATCH_SIZE):
+        for table, column in ((TABLE, 'rowid'), (NAMES_TABLE, 'id')):
+            db.execute(
+                sa.text(
+                    f'DELETE FROM {table} WHERE {column} IN :ids'
+                ).bindparams(sa.bindparam('ids', expanding=True)),
+                {'ids': object_ids[i : i + BACKFILL_BATCH_SIZE]},
+            )
+
+
+def _escape_like(value: str) -> str:
+    return (
+        value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    )
+
+
+def search(
+    db: Session,
+    query: str,
+    prefix: bool = False,
+    extension: str = None,
+    limit: int = 20,
+    offset: int = 0,
+) -> List[Hit]:
+    """
+    substring search over names and paths, or name prefix search.
+    queries of three or more characters are ranked by bm25.  shorter
+    prefixes are listed by name, and an empty query lists objects by id.
+    shorter substrings cannot use the index and are rejected.
+    """
+    if 0 < len(query) < MIN_SUBSTRING and not prefix:
+        raise ValueError(
+            f'substring queries need at least {MIN_SUBSTRING} characters,'
+            ' use --prefix for shorter name prefixes'
+        )
+    params = {'limit': limit, 'offset': offset}
+    ext = ''
+    if extension:
+        params['ext'] = normalize_extension(extension)
+        ext = 'ext = :ext'
+    if len(query) < MIN_SUBSTRING:
+        clauses = [ext] if ext else []
+        order = ['id']
+        if query:
+            # NOCASE range over the name index, like the trigram match
+            params['low'] = query
+            params['high'] = query + '\U0010ffff'
+            clauses.append('name >= :low AND name < :high')
+            order = ['name', 'id']
+        where = f'WHERE {" AND ".join(clauses)}' if clauses else ''
+        rows = db.execute(
+            sa.text(
+                f'SELECT n.id, s.path, 0.0 FROM'
+                f' (SELECT id, name FROM {NAMES_TABLE} {where}'
+                f' ORDER BY {", ".join(order)} LIMIT :limit OFFSET :offset)'
+                f' n JOIN {TABLE} s ON s.rowid = n.id'
+                f' ORDER BY {", ".join(f"n.{c}" for c in order)}'
+            ),
+            params,
+        )
+        return [Hit(id=row[0], path=row[1], score=row[2]) for row in rows]
+    column = 'name' if prefix else '{name path}'
+    escaped = query.replace('"', '""')
+    params['match'] = f'{column} : "{escaped}"'
+    clauses = [f'{TABLE} MATCH :match']
+    if prefix:
+        params['like'] = f'{_escape_like(query)}%'
+        clauses.append("name LIKE :like ESCAPE '\\'")
+    if ext:
+        clauses.append(f'rowid IN (SELECT id FROM {NAMES_TABLE} WHERE {ext})')
+    rows = db.execute(
+        sa.text(
+            f'SELECT rowid, path, -rank FROM {TABLE}'
+            f' WHERE {" AND ".join(clauses)}'
+            ' ORDER BY rank, rowid LIMIT :limit OFFSET :offset'
+        ),
+        params,
+    )
+    return [Hit(id=row[0], path=row[1], score=row[2]) for row in rows]
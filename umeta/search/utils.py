@@ -0,0 +1,18 @@
+import os
+from dataclasses import dataclass
+
+
+@dataclass
+class Hit:
+    id: int
+    path: str
+    score: float
+
+
+def get_extension(path: str) -> str:
+    return os.path.splitext(path)[1].lower()
+
+
+def normalize_extension(extension: str) -> str:
+    extension = extension.lower()
+    return extension if extension.startswith('.') else f'.{extension}'
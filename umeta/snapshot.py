@@ -0,0 +1,119 @@
+import heapq
+from array import array
+from bisect import bisect_left
+from typing import Iterator, Optional
+
+from umeta import core
+
+# rows sorted in memory at a time by Snapshot.sort, before merging
+SORT_RUN_SIZE = 1 << 16
+
+
+class Snapshot:
+    """
+    compact view of a source's objects taken at the start of a reindex.
+    objects are keyed by the hash of (bucket, key).  hashes, ids, types,
+    sizes and mtimes live in parallel typed arrays, about 33 bytes per
+    object, sorted by hash once loaded so lookups are a binary search.
+
+    a bitmap records which rows a lookup matched, so the objects a reindex
+    did not see can be found without touching the database.
+
+    a hash collision that also has identical type, size and mtime resolves
+    obj to the other object's id.  obj itself is then never marked seen,
+    and the reindex deletes it.
+    """
+
+    def __init__(self):
+        self.hashes = array('q')
+        self.ids = array('q')
+        self.types = array('b')
+        self.sizes = array('q')
+        self.modified = array('q')
+        # bit i is set once row i is matched by unchanged
+        self.matched = bytearray()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def add(
+        self,
+        bucket: str,
+        key: Optional[str],
+        object_id: int,
+        type: core.ObjectType,
+        size: int,
+        modified: int,
+    ):
+        self.hashes.append(hash((bucket, key)))
+        self.ids.append(object_id)
+        self.types.append(type.value)
+        self.sizes.append(size)
+        self.modified.append(modified)
+
+    def sort(self):
+        """
+        order the arrays by hash, after the last add.  runs of rows are
+        sorted separately and merged, so no per-object python list of the
+        whole snapshot is ever built.
+        """
+        runs = []
+        for start in range(0, len(self.hashes), SORT_RUN_SIZE):
+            stop = min(start + SORT_RUN_SIZE, len(self.hashes))
+            run = sorted(zip(self.hashes[start:stop], range(start, stop)))
+            runs.append(
+                (
+                    array('q', (h for h, _ in run)),
+                    array('q', (r for _, r in run)),
+                )
+            )
+        merged = heapq.merge(*(zip(hashes, rows) for hashes, rows in runs))
+        order = array('q', (row for _, row in merged))
+        del runs, merged
+        for name in ('hashes', 'ids', 'types', 'sizes', 'modified'):
+            column = getattr(self, name)
+            setattr(
+                self,
+                name,
+                array(column.typecode, map(column.__getitem__, order)),
+            )
+        self.matched = bytearray((len(self.ids) + 7) // 8)
+
+    def unchanged(self, obj: core.Object) -> Optional[int]:
+        """
+        id of obj if it existed with the same type, size and mtime
+        """
+        h = hash((obj.bucket, obj.key))
+        i = bisect_left(self.hashes, h)
+        if (
+            i == len(self.hashes)
+            or self.hashes[i] != h
+            or self.types[i] != obj.type.value
+            or self.sizes[i] != obj.size
+            or self.modified[i] != obj.modified
+        ):
+            return None
+        self.matched[i >> 3] |= 1 << (i & 7)
+        return self.ids[i]
+
+    def _rows(self, matched: bool) -> Iterator[int]:
+        skip = 0 if matched else 0xFF
+        for byte_index, byte in enumerate(self.matched):
+            if byte == skip:
+                continue
+            for bit in range(8):
+                row = byte_index * 8 + bit
+                if row < len(self.ids) and bool(byte >> bit & 1) == matched:
+                    yield self.ids[row]
+
+    def seen(self) -> Iterator[int]:
+        """
+        ids of the objects unchanged has matched
+        """
+        return self._rows(True)
+
+    def unseen(self) -> Iterator[int]:
+        """
+        ids of the objects unchanged has not matched
+        """
+        return self._rows(False)
@@ -1,14 +1,23 @@
-from typing import Any, Dict, Iterator, List, Tuple
+import multiprocessing
+import queue
+import signal
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 from umeta import config, core
 
-from . import disk, s3
+from . import disk, s3, throttle
+
+# (source, bucket name, checkpoint directory to resume after)
+ScanWork = List[Tuple[config.Source, str, Optional[str]]]
 
 sources: Dict[str, Any] = {
     'disk': disk,
     's3': s3,
 }
 
+# objects sent from a scan worker to the writer per queue message
+SCAN_BATCH_SIZE = 500
+
 
 def get_module(sourcetype: str):
     return sources[sourcetype]
@@ -28,3 +37,91 @@ def index(
     for source in sources:
         for obj in get_module(source.type).index(source):
             yield (source, obj)
+
+
+def index_buckets(
+    work: ScanWork,
+) -> Iterator[Tuple[config.Source, core.Object]]:
+    for source, bucket, after in work:
+        module = get_module(source.type)
+        for obj in module.index_bucket(source, bucket, after):
+            yield (source, obj)
+
+
+def _scan_worker(
+    work: ScanWork,
+    tasks: multiprocessing.Queue,
+    results: multiprocessing.Queue,
+    throttles: Dict[str, throttle.Throttle],
+):
+    # rate reports and limit reloads are handled by the parent
+    signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    throttle.throttles.update(throttles)
+    for i in iter(tasks.get, None):
+        source, bucket, after = work[i]
+        module = get_module(source.type)
+        try:
+            batch = []
+            for obj in module.index_bucket(source, bucket, after):
+                batch.append(obj)
+                if len(batch) >= SCAN_BATCH_SIZE:
+                    results.put((i, batch, False, None))
+                    batch = []
+            results.put((i, batch, True, None))
+        except Exception as err:
+            results.put((i, None, True, f'{type(err).__name__}: {err}'))
+
+
+def index_buckets_parallel(
+    work: ScanWork, jobs: int,
+) -> Iterator[Tuple[config.Source, core.Object]]:
+    """
+    scan (source, bucket, checkpoint) work items in `jobs` worker processes.
+    objects from different buckets are interleaved, but each bucket's
+    objects arrive in walk order, so parents still precede children.
+    workers never touch the database; the consumer is the only writer.
+    """
+    tasks = multiprocessing.Queue()
+    # bounded, so slow writers apply backpressure to the walkers
+    results = multiprocessing.Queue(maxsize=jobs * 4)
+    for i in range(len(work)):
+        tasks.put(i)
+    throttles = {s.name: throttle.get_throttle(s) for s, _, _ in work}
+    workers = [
+        multiprocessing.Process(
+            target=_scan_worker,
+            args=(work, tasks, results, throttles),
+            daemon=True,
+        )
+        for _ in range(min(jobs, len(work)))
+    ]
+    for _ in workers:
+        tasks.put(None)
+    for w in workers:
+        w.start()
+    try:
+        remaining = len(work)
+        while remaining:
+            try:
+                i, batch, done, err = results.get(timeout=1)
+            except queue.Empty:
+                if not any(w.is_alive() for w in workers):
+                    raise RuntimeError('scan workers exited unexpectedly')
+                continue
+            if err is not None:
+                source, bucket, _ = work[i]
+                raise RuntimeError(
+                    f'scan failed for source={source.name}'
+                    f' bucket={bucket}: {err}'
+                )
+            source = work[i][0]
+            for obj in batch:
+                yield (source, obj)
+            if done:
+                remaining -= 1
+    finally:
+        for w in workers:
+            if w.is_alive():
+                w.terminate()
+            w.join()
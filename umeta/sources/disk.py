@@ -1,13 +1,16 @@
+import logging
 import os
 import stat
 from datetime import datetime
-from glob import glob
-from typing import Iterator, BinaryIO, List, Tuple, Union
+from typing import Iterator, BinaryIO, List, Optional, Tuple, Union
 
 from umeta import config, core
 
+from .throttle import get_throttle, ionice, open_throttled
 from .utils import Ignore
 
+logger = logging.getLogger(__name__)
+
 
 def parse_path(relpath: str) -> Tuple[str, List[str]]:
     split = relpath.split(os.sep)
@@ -20,8 +23,11 @@ def parse_path(relpath: str) -> Tuple[str, List[str]]:
 
 
 def scan_for_buckets(source: config.Source) -> Iterator[core.Object]:
+    stats = get_throttle(source).stats
+    stats.acquire()
     results = os.listdir(source.properties.root)
     for r in results:
+        stats.acquire()
         f = os.stat(os.path.join(source.properties.root, r))
         if stat.S_ISDIR(f.st_mode):
             bucket, key = parse_path(r)
@@ -37,29 +43,102 @@ def scan_for_buckets(source: config.Source) -> Iterator[core.Object]:
 
 
 def get_bytes(source: config.Source, obj: core.Object) -> BinaryIO:
-    if obj.type == ObjectType.directory:
+    if obj.type == core.ObjectType.directory:
         raise ValueError('cannot open directory for reading')
     abspath = os.path.abspath(source.properties.root)
-    path = os.path.join(abspath, obj.bucket, obj.bucket_key)
-    return open(path, 'rb')
+    path = os.path.join(abspath, obj.bucket, obj.key)
+    return open_throttled(source, path)
 
 
-def index(source: config.Source) -> Iterator[core.Object]:
-    search = os.path.join(os.path.abspath(source.properties.root), '**/*')
-    result = glob(search, recursive=True)
+def split_key(key: str) -> Tuple[str, ...]:
+    return tuple(part for part in key.split(os.sep) if part)
+
+
+def index_bucket(
+    source: config.Source, bucket: str, after: Optional[str] = None
+) -> Iterator[core.Object]:
+    """
+    walk a bucket depth first in sorted order, emitting one directory
+    listing at a time, so the walk order is stable between runs.
+    listings up to and including the directory key `after` ('' for the
+    bucket root) are skipped, and subtrees entirely before it are not
+    visited at all.  dotfiles are skipped, like the glob walk before it.
+    entries that cannot be listed or stat'ed are logged and emitted as
+    unreadable, so the reindex keeps them rather than deleting them.
+    """
+    root = os.path.abspath(source.properties.root)
+    frontier = None if after is None else split_key(after)
     ignorer = Ignore()
-    for r in ignorer.filterIgnored(result):
-        f = os.stat(r)
-        relpath = os.path.relpath(r, source.properties.root)
-        bucket, key = parse_path(relpath)
-        yield core.Object(
-            type=(
-                core.ObjectType.directory
-                if stat.S_ISDIR(f.st_mode)
-                else core.ObjectType.file
-            ),
-            bucket=bucket,
-            key=key,
-            modified=int(datetime.utcfromtimestamp(f.st_mtime).timestamp()),
-            size=f.st_size,
-        )
+    stats = get_throttle(source).stats
+    ionice(source)
+    stack = [()]
+    while stack:
+        parts = stack.pop()
+        stats.acquire()
+        path = os.path.join(root, bucket, *parts)
+        try:
+            with os.scandir(path) as it:
+                entries = sorted(
+                    (e for e in it if not e.name.startswith('.')),
+                    key=lambda e: e.name,
+                )
+        except OSError as err:
+            logger.warning('cannot list %s: %s', path, err)
+            yield core.Object(
+                type=core.ObjectType.directory,
+                bucket=bucket,
+                key=os.sep.join(parts) or None,
+                unreadable=True,
+            )
+            continue
+        kept = set(ignorer.filterIgnored([e.path for e in entries]))
+        entries = [e for e in entries if e.path in kept]
+        subdirs = []
+        for entry in entries:
+            child = parts + (entry.name,)
+            try:
+                if not entry.is_dir():
+                    continue
+            except OSError:
+                continue
+            if (
+                frontier is not None
+                and child < frontier
+                and frontier[: len(child)] != child
+            ):
+                continue
+            subdirs.append(child)
+        stack.extend(reversed(subdirs))
+        if frontier is not None and parts <= frontier:
+            continue
+        for entry in entries:
+            stats.acquire()
+            try:
+                f = entry.stat()
+            except OSError as err:
+                logger.warning('cannot stat %s: %s', entry.path, err)
+                yield core.Object(
+                    bucket=bucket,
+                    key=os.sep.join(parts + (entry.name,)),
+                    unreadable=True,
+                )
+                continue
+            yield core.Object(
+                type=(
+                    core.ObjectType.directory
+                    if stat.S_ISDIR(f.st_mode)
+                    else core.ObjectType.file
+                ),
+                bucket=bucket,
+                key=os.sep.join(parts + (entry.name,)),
+                modified=int(
+                    datetime.utcfromtimestamp(f.st_mtime).timestamp()
+                ),
+                size=f.st_size,
+            )
+
+
+def index(source: config.Source) -> Iterator[core.Object]:
+    for bucket in scan_for_buckets(source):
+        yield bucket
+        yield from index_bucket(source, bucket.bucket)
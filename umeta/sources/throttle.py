@@ -0,0 +1,148 @@
+import io
+import multiprocessing
+import os
+import subprocess
+import time
+from typing import BinaryIO, Dict, List
+
+from umeta import config
+
+
+class TokenBucket:
+    """
+    rate limiter in shared memory, so worker processes started after it
+    draw from the same budget.  holds at most one second of tokens and may
+    go into debt, so acquiring more than the rate at once only waits longer.
+    a rate of 0 is unlimited, but usage is still counted.
+    """
+
+    def __init__(self, rate: float):
+        self.lock = multiprocessing.Lock()
+        self.rate = multiprocessing.Value('d', rate, lock=False)
+        self.tokens = multiprocessing.Value('d', rate, lock=False)
+        self.last = multiprocessing.Value('d', time.monotonic(), lock=False)
+        self.total = multiprocessing.Value('d', 0, lock=False)
+        # set_rate only records the new rate, acquire applies it under the
+        # lock once `requested` has moved past `applied`
+        self.pending = multiprocessing.Value('d', rate, lock=False)
+        self.requested = multiprocessing.Value('q', 0, lock=False)
+        self.applied = multiprocessing.Value('q', 0, lock=False)
+
+    def acquire(self, n: float = 1):
+        wait = 0.0
+        with self.lock:
+            self.total.value += n
+            requested = self.requested.value
+            if requested != self.applied.value:
+                self.applied.value = requested
+                self.rate.value = self.pending.value
+                self.tokens.value = min(self.tokens.value, self.rate.value)
+            rate = self.rate.value
+            if rate <= 0:
+                return
+            now = time.monotonic()
+            tokens = self.tokens.value + (now - self.last.value) * rate
+            tokens = min(tokens, rate) - n
+            self.tokens.value = tokens
+            self.last.value = now
+            if tokens < 0:
+                wait = -tokens / rate
+        time.sleep(wait)
+
+    def set_rate(self, rate: float):
+        """
+        takes effect at the next acquire.  does not take the lock, so it is
+        safe to call from a signal handler that interrupted acquire.
+        """
+        self.pending.value = rate
+        self.requested.value += 1
+
+
+class Throttle:
+    def __init__(self, limits: config.Limits):
+        self.stats = TokenBucket(limits.stats_per_second)
+        self.bytes = TokenBucket(limits.bytes_per_second)
+        self.ionice_class = limits.ionice_class
+        self.reported = (time.monotonic(), 0.0, 0.0)
+
+    def update(self, limits: config.Limits):
+        self.stats.set_rate(limits.stats_per_second)
+        self.bytes.set_rate(limits.bytes_per_second)
+        self.ionice_class = limits.ionice_class
+
+    def rates(self) -> Dict[str, float]:
+        """
+        observed stat calls and bytes per second since the previous call
+        """
+        now = time.monotonic()
+        stats, nbytes = self.stats.total.value, self.bytes.total.value
+        then, prev_stats, prev_bytes = self.reported
+        self.reported = (now, stats, nbytes)
+        elapsed = max(now - then, 1e-9)
+        return {
+            'stats_per_second': (stats - prev_stats) / elapsed,
+            'bytes_per_second': (nbytes - prev_bytes) / elapsed,
+            'stats_limit': self.stats.rate.value,
+            'bytes_limit': self.bytes.rate.value,
+        }
+
+
+class ThrottledReader(io.RawIOBase):
+    def __init__(self, raw: BinaryIO, bucket: TokenBucket):
+        self.raw = raw
+        self.bucket = bucket
+
+    def readinto(self, b) -> int:
+        n = self.raw.readinto(b)
+        if n:
+            self.bucket.acquire(n)
+        return n
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return self.raw.seekable()
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        return self.raw.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self.raw.tell()
+
+    def close(self):
+        self.raw.close()
+        super().close()
+
+
+# source name -> throttle.  scan workers are handed the parent's throttles,
+# so every process draws from the same buckets.
+throttles: Dict[str, Throttle] = {}
+
+
+def get_throttle(source: config.Source) -> Throttle:
+    if source.name not in throttles:
+        throttles[source.name] = Throttle(source.limits)
+    return throttles[source.name]
+
+
+def update_throttles(sources: List[config.Source]):
+    for source in sources:
+        if source.name in throttles:
+            throttles[source.name].update(source.limits)
+
+
+def open_throttled(source: config.Source, path: str) -> BinaryIO:
+    bucket = get_throttle(source).bytes
+    return io.BufferedReader(
+        ThrottledReader(open(path, 'rb', buffering=0), bucket)
+    )
+
+
+def ionice(source: config.Source):
+    ionice_class = get_throttle(source).ionice_class
+    if ionice_class is not None:
+        subprocess.run(
+            ['ionice', '-c', str(ionice_class), '-p', str(os.getpid())],
+            check=True,
+        )